@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Uglier interpreter
+Run with a benchmark name, e.g. `python bench_uglier.py pipeline`
+"""
+
+import argparse
+import io
+import resource
+import sys
+import time
+
+from uglier import execute_block, reset_state
+
+def run_program(code):
+    """Execute a program on a clean interpreter, discarding its output"""
+    reset_state()
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        execute_block(code.split('\n'))
+    finally:
+        sys.stdout = old_stdout
+
+def peak_rss():
+    """Peak resident set size of this process so far, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def measure(code):
+    """Return (seconds, peak memory growth in bytes) for one run of a program.
+    
+    Memory is the growth of the process's peak RSS over the run, which
+    costs nothing while the program runs (tracemalloc would slow a 10^7
+    pipeline down to hours). The peak never goes down, so a run only
+    shows up if it needs more than every earlier one: measure sizes in
+    ascending order.
+    """
+    before = peak_rss()
+    start = time.perf_counter()
+    run_program(code)
+    elapsed = time.perf_counter() - start
+    return elapsed, peak_rss() - before
+
+def timed(code):
+    """Return wall-clock seconds for one run of a program"""
+    start = time.perf_counter()
+    run_program(code)
+    return time.perf_counter() - start
+
+# -------------------------
+# Benchmarks
+# -------------------------
+PIPELINE = """def evens(src):
+    for x in src:
+        if x % 2 == 0:
+            yield x
+
+def squares(src):
+    for x in src:
+        yield x * x
+
+let total = 0
+for v in squares(evens(range({n}))):
+    total += v
+"""
+
+def bench_pipeline(sizes):
+    """Generator pipeline: peak memory should stay flat as n grows"""
+    print(f"{'n':>12} {'seconds':>10} {'peak KiB':>10}")
+    for n in sorted(sizes):
+        elapsed, peak = measure(PIPELINE.replace("{n}", str(n)))
+        print(f"{n:>12} {elapsed:>10.3f} {peak / 1024:>10.1f}")
+
+APPEND_LOOP = """let squares = []
+for x in range({n}):
+    if x % 3 == 0:
+        squares.append(x * x)
+"""
+
+COMPREHENSION = """let squares = [x * x for x in range({n}) if x % 3 == 0]
+"""
+
+def bench_comprehension(sizes):
+    """Loop with .append versus the equivalent list comprehension"""
+    print(f"{'n':>12} {'loop s':>10} {'comp s':>10} {'speedup':>10}")
+    for n in sizes:
+        loop_time = timed(APPEND_LOOP.replace("{n}", str(n)))
+        comp_time = timed(COMPREHENSION.replace("{n}", str(n)))
+        print(f"{n:>12} {loop_time:>10.3f} {comp_time:>10.4f} {loop_time / comp_time:>9.0f}x")
+
+LOOP_SUM_SQUARES = """let total = 0
+for x in range({n}):
+    total += x * x
+"""
+
+ARRAY_SUM_SQUARES = """let xs = arange({n})
+let total = (xs * xs).sum()
+"""
+
+def bench_array(sizes):
+    """Interpreted loop versus array arithmetic for a sum of squares"""
+    print(f"{'n':>12} {'loop s':>10} {'array s':>10} {'speedup':>10}")
+    for n in sizes:
+        loop_time = timed(LOOP_SUM_SQUARES.replace("{n}", str(n)))
+        array_time = timed(ARRAY_SUM_SQUARES.replace("{n}", str(n)))
+        print(f"{n:>12} {loop_time:>10.3f} {array_time:>10.4f} {loop_time / array_time:>9.0f}x")
+
+RECURSION = """def depth(n):
+    if n == 0:
+        return 0
+    return 1 + depth(n - 1)
+
+let d = depth({n})
+"""
+
+def bench_recursion(sizes):
+    """Non-tail recursion: memory per frame should stay constant"""
+    print(f"{'depth':>12} {'seconds':>10} {'peak KiB':>10} {'B/frame':>10}")
+    for n in sorted(sizes):
+        elapsed, peak = measure(RECURSION.replace("{n}", str(n)))
+        print(f"{n:>12} {elapsed:>10.3f} {peak / 1024:>10.1f} {peak / n:>10.0f}")
+
+def bench_literal(sizes):
+    """Loading large pasted data tables as literals"""
+    print(f"{'n':>12} {'ints ms':>10} {'dicts ms':>10} {'mixed ms':>10}")
+    for n in sizes:
+        ints = "[" + ", ".join(str(i) for i in range(n)) + "]"
+        dicts = "[" + ", ".join(f'{{"id": {i}, "name": "n{i}", "ok": True}}' for i in range(n)) + "]"
+        mixed = "[" + ", ".join(str(i) for i in range(n)) + ", x]"
+        ints_time = timed(f"let data = {ints}")
+        dicts_time = timed(f"let data = {dicts}")
+        mixed_time = timed(f"let x = 1\nlet data = {mixed}")
+        print(f"{n:>12} {ints_time * 1000:>10.1f} {dicts_time * 1000:>10.1f} {mixed_time * 1000:>10.1f}")
+
+CONCAT = """let s = ""
+for i in range({n}):
+    s += "line " + str(i)
+let size = len(s)
+"""
+
+def bench_concat(sizes):
+    """String accumulation with +=: time per append should stay flat"""
+    print(f"{'n':>12} {'seconds':>10} {'us/append':>10}")
+    for n in sizes:
+        elapsed = timed(CONCAT.replace("{n}", str(n)))
+        print(f"{n:>12} {elapsed:>10.3f} {elapsed / n * 1e6:>10.2f}")
+
+SEARCH = """def count_primes(block):
+    let found = 0
+    for n in range(block * {n}, (block + 1) * {n}):
+        let d = 2
+        let prime = n > 1
+        while d * d <= n and prime:
+            if n % d == 0:
+                prime = False
+            d += 1
+        if prime:
+            found += 1
+    return found
+
+let total = sum({mapper}(count_primes, range(8){workers}))
+"""
+
+def bench_parallel(sizes):
+    """Brute-force search: serial map versus parallel_map across cores"""
+    print(f"{'block':>12} {'serial s':>10} {'parallel s':>10} {'speedup':>10}")
+    for n in sizes:
+        program = SEARCH.replace("{n}", str(n))
+        serial_time = timed(program.replace("{mapper}", "map").replace("{workers}", ""))
+        parallel_time = timed(program.replace("{mapper}", "parallel_map").replace("{workers}", ", workers=8"))
+        print(f"{n:>12} {serial_time:>10.3f} {parallel_time:>10.3f} {serial_time / parallel_time:>9.1f}x")
+
+BENCHMARKS = {
+    "pipeline": (bench_pipeline, [10**3, 10**4, 10**5]),
+    "comprehension": (bench_comprehension, [10**3, 10**4, 10**5]),
+    "array": (bench_array, [10**3, 10**4, 10**5]),
+    "recursion": (bench_recursion, [10**3, 10**4]),
+    "literal": (bench_literal, [10**3, 10**4, 10**5]),
+    "concat": (bench_concat, [10**3, 10**4, 10**5]),
+    "parallel": (bench_parallel, [500, 2000]),
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Uglier benchmarks")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--sizes", type=int, nargs="+", help="problem sizes (e.g. 10000000)")
+    args = parser.parse_args()
+
+    bench, default_sizes = BENCHMARKS[args.name]
+    bench(args.sizes or default_sizes)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Differential fuzzing for the Uglier interpreter
+Generates random programs in the Python subset Uglier supports, runs each
+under the Uglier engines and under CPython, and compares printed output and
+final variables. Also reports how long each engine took relative to CPython.
+
+    python fuzz_uglier.py --count 2000 --seed 1
+"""
+
+import argparse
+import io
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+import uglier
+from uglier import Run, reset_state, run_program
+
+# -------------------------
+# Program generator
+# -------------------------
+VARIABLES = ["a", "b", "c", "d", "e"]
+LOOP_VARIABLES = ["i", "j", "k"]
+PARAMS = ["p", "q"]
+# Also compared after the run: lists, while-loop counters, strings, string
+# aliases and dicts
+COMPARED_PREFIXES = ("xs", "w", "s", "u", "m")
+WORDS = ["ab", "x", "", "hello", "q q", "7"]
+
+class ProgramGenerator:
+    """Random programs that mean the same thing in Uglier and CPython.
+
+    Besides arithmetic and control flow, programs reach the interpreter's
+    fast paths: string += (including rebinding a string to an alias of an
+    older value), pasted literal tables, comprehensions, generator
+    functions and a class with methods.
+
+    Known, documented differences are kept out: function bodies don't
+    assign (Uglier scopes dynamically), loop variables aren't compared
+    afterwards (Uglier restores them), there is no break/continue, and
+    print takes a single argument.
+    """
+    def __init__(self, rng, max_depth=3, max_statements=12):
+        self.rng = rng
+        self.max_depth = max_depth
+        self.max_statements = max_statements
+        self.defined = []
+        self.lists = []
+        self.strings = []
+        self.dicts = []
+        self.functions = {}
+        self.generators = []
+        self.objects = []
+        self.lines = []
+
+    def generate(self):
+        for _ in range(self.rng.randint(1, 3)):
+            self.function()
+        if self.rng.random() < 0.5:
+            self.generator()
+        if self.rng.random() < 0.5:
+            self.klass()
+        for name in self.rng.sample(VARIABLES, 2):
+            self.emit(0, f"{name} = {self.rng.randint(0, 9)}")
+            self.defined.append(name)
+        for _ in range(self.rng.randint(3, self.max_statements)):
+            self.statement(0, self.max_depth)
+        return "\n".join(self.lines) + "\n"
+
+    def emit(self, indent, text):
+        self.lines.append("    " * indent + text)
+
+    # Expressions
+    def expr(self, depth, names=None):
+        names = self.defined if names is None else names
+        choice = self.rng.random()
+        if depth <= 0 or choice < 0.25:
+            if names and self.rng.random() < 0.6:
+                return self.rng.choice(names)
+            return str(self.rng.randint(0, 20))
+        if choice < 0.55:
+            op = self.rng.choice(["+", "-", "*"])
+            return f"({self.expr(depth - 1, names)} {op} {self.expr(depth - 1, names)})"
+        if choice < 0.65:
+            op = self.rng.choice(["//", "%"])
+            return f"({self.expr(depth - 1, names)} {op} {self.rng.randint(1, 9)})"
+        if choice < 0.75:
+            builtin = self.rng.choice(["min", "max"])
+            return f"{builtin}({self.expr(depth - 1, names)}, {self.expr(depth - 1, names)})"
+        if choice < 0.8:
+            return f"abs({self.expr(depth - 1, names)})"
+        if choice < 0.85 and self.lists and names is self.defined:
+            return f"len({self.rng.choice(self.lists)})"
+        if choice < 0.88 and names is self.defined and (self.strings or self.dicts):
+            if self.dicts and (not self.strings or self.rng.random() < 0.5):
+                return f"{self.rng.choice(self.dicts)}['k{self.rng.randint(0, 1)}']"
+            return f"len({self.rng.choice(self.strings)})"
+        if choice < 0.91 and names is self.defined:
+            return f"sum([v * {self.rng.randint(1, 3)} for v in range({self.expr(depth - 1, names)} % 7)])"
+        if choice < 0.94 and self.generators and names is self.defined:
+            return f"sum({self.rng.choice(self.generators)}({self.expr(depth - 1, names)}))"
+        if choice < 0.97 and self.objects and names is self.defined:
+            return f"{self.rng.choice(self.objects)}.get({self.expr(depth - 1, names)})"
+        if self.functions and names is self.defined:
+            name = self.rng.choice(list(self.functions))
+            args = ", ".join(self.expr(depth - 1, names) for _ in range(self.functions[name]))
+            return f"{name}({args})"
+        return self.expr(0, names)
+
+    def condition(self, depth, names=None):
+        op = self.rng.choice(["<", "<=", ">", ">=", "==", "!="])
+        cond = f"{self.expr(depth, names)} {op} {self.expr(depth, names)}"
+        if self.rng.random() < 0.2:
+            joiner = self.rng.choice(["and", "or"])
+            cond = f"{cond} {joiner} {self.expr(0, names)} > {self.rng.randint(0, 9)}"
+        return cond
+
+    # Statements
+    def function(self):
+        name = f"f{len(self.functions)}"
+        params = PARAMS[:self.rng.randint(1, 2)]
+        self.emit(0, f"def {name}({', '.join(params)}):")
+        if self.rng.random() < 0.5:
+            self.emit(1, f"if {self.condition(1, params)}:")
+            self.emit(2, f"return {self.expr(2, params)}")
+        self.emit(1, f"return {self.expr(2, params)}")
+        self.emit(0, "")
+        self.functions[name] = len(params)
+
+    def generator(self):
+        name = f"g{len(self.generators)}"
+        self.emit(0, f"def {name}(p):")
+        self.emit(1, "for v in range(p % 6):")
+        if self.rng.random() < 0.5:
+            self.emit(2, f"if v % {self.rng.randint(2, 3)} == 0:")
+            self.emit(3, f"yield v * {self.rng.randint(1, 4)}")
+        else:
+            self.emit(2, f"yield v + {self.rng.randint(0, 4)}")
+        self.emit(0, "")
+        self.generators.append(name)
+
+    def klass(self):
+        """A class with a default, __init__, a reader and a mutator"""
+        self.emit(0, "class Box:")
+        self.emit(1, f"step = {self.rng.randint(1, 3)}")
+        self.emit(1, "def __init__(self, p):")
+        self.emit(2, "self.v = p % 100")
+        self.emit(1, "def get(self, q):")
+        self.emit(2, f"return (self.v {self.rng.choice(['+', '-', '*'])} q) % 1000")
+        self.emit(1, "def bump(self, q):")
+        self.emit(2, "self.v = (self.v + q) % 1000")
+        self.emit(2, "self.step += 1")
+        self.emit(2, "return self.step")
+        self.emit(0, "")
+        for n in range(self.rng.randint(1, 2)):
+            self.emit(0, f"o{n} = Box({self.rng.randint(0, 9)})")
+            self.objects.append(f"o{n}")
+
+    def string_statement(self, indent):
+        if not self.strings or (indent == 0 and self.rng.random() < 0.2):
+            name = f"s{len(self.strings)}"
+            self.emit(indent, f"{name} = {self.rng.choice(WORDS)!r}")
+            if indent == 0:
+                self.strings.append(name)
+            return
+        name = self.rng.choice(self.strings)
+        choice = self.rng.random()
+        if choice < 0.5:
+            piece = repr(self.rng.choice(WORDS)) if self.rng.random() < 0.5 else f"str({self.expr(1)})"
+            self.emit(indent, f"{name} += {piece}")
+        elif choice < 0.7:
+            # append, then rebind the name to a copy of its older value
+            alias = "u" + name[1:]
+            self.emit(indent, f"{alias} = {name}")
+            self.emit(indent, f"{name} += {self.rng.choice(WORDS)!r}")
+            self.emit(indent, f"{name} = {alias}")
+        elif choice < 0.85:
+            self.emit(indent, f"print({name})")
+        else:
+            self.emit(indent, f"{name} = {self.rng.choice(self.strings)} + {self.rng.choice(WORDS)!r}")
+
+    def literal_statement(self, indent):
+        if indent or self.rng.random() < 0.5:
+            name = f"xs{len(self.lists)}"
+            items = [str(self.rng.randint(-50, 50)) for _ in range(self.rng.randint(0, 40))]
+            if items and self.rng.random() < 0.3:
+                items[self.rng.randrange(len(items))] = self.rng.choice(self.defined)
+            self.emit(indent, f"{name} = [{', '.join(items)}]")
+            if indent == 0:
+                self.lists.append(name)
+        else:
+            name = f"m{len(self.dicts)}"
+            pairs = [f"'k{n}': {self.rng.randint(0, 99)}" for n in range(self.rng.randint(2, 6))]
+            self.emit(indent, f"{name} = {{{', '.join(pairs)}}}")
+            self.dicts.append(name)
+
+    def statement(self, indent, depth):
+        kind = self.rng.choice(["assign", "assign", "compound", "print", "if", "for", "while", "list",
+                                "string", "string", "literal", "comprehension", "generator", "method"])
+        if kind in ("if", "for", "while") and depth <= 0:
+            kind = "assign"
+        if kind == "generator" and not self.generators or kind == "method" and not self.objects:
+            kind = "assign"
+        if kind == "comprehension" and not self.lists:
+            kind = "literal"
+
+        if kind == "assign":
+            name = self.rng.choice(VARIABLES)
+            # keep numbers from growing without bound inside loops
+            self.emit(indent, f"{name} = {self.expr(2)} % 1000")
+            if name not in self.defined and indent == 0:
+                self.defined.append(name)
+        elif kind == "compound" and self.defined:
+            name = self.rng.choice(self.defined)
+            op = self.rng.choice(["+=", "-=", "*="])
+            self.emit(indent, f"{name} {op} {self.rng.randint(0, 5)}")
+        elif kind == "print":
+            target = self.rng.choice(self.lists) if self.lists and self.rng.random() < 0.3 else self.expr(2)
+            self.emit(indent, f"print({target})")
+        elif kind == "if":
+            self.emit(indent, f"if {self.condition(1)}:")
+            self.block(indent + 1, depth - 1)
+            if self.rng.random() < 0.3:
+                self.emit(indent, f"elif {self.condition(1)}:")
+                self.block(indent + 1, depth - 1)
+            if self.rng.random() < 0.5:
+                self.emit(indent, "else:")
+                self.block(indent + 1, depth - 1)
+        elif kind == "for":
+            loop_var = LOOP_VARIABLES[min(indent, len(LOOP_VARIABLES) - 1)]
+            self.emit(indent, f"for {loop_var} in range({self.rng.randint(0, 6)}):")
+            self.defined.append(loop_var)
+            self.block(indent + 1, depth - 1)
+            self.defined.remove(loop_var)
+        elif kind == "while":
+            counter = f"w{indent}"
+            self.emit(indent, f"{counter} = 0")
+            self.emit(indent, f"while {counter} < {self.rng.randint(0, 5)}:")
+            self.emit(indent + 1, f"{counter} += 1")
+            self.block(indent + 1, depth - 1)
+        elif kind == "string":
+            self.string_statement(indent)
+        elif kind == "literal":
+            self.literal_statement(indent)
+        elif kind == "comprehension":
+            name = f"xs{len(self.lists)}"
+            source = self.rng.choice(self.lists)
+            cond = f" if v % {self.rng.randint(2, 4)} == {self.rng.randint(0, 1)}" if self.rng.random() < 0.5 else ""
+            self.emit(indent, f"{name} = [v * {self.rng.randint(1, 3)} + {self.expr(0)} for v in {source}{cond}]")
+            if indent == 0:
+                self.lists.append(name)
+        elif kind == "generator":
+            gen = self.rng.choice(self.generators)
+            if depth > 0 and self.rng.random() < 0.5:
+                self.emit(indent, f"for v in {gen}({self.expr(1)}):")
+                self.emit(indent + 1, "print(v)")
+            else:
+                self.emit(indent, f"print(list({gen}({self.expr(1)})))")
+        elif kind == "method":
+            obj = self.rng.choice(self.objects)
+            if self.rng.random() < 0.5:
+                self.emit(indent, f"print({obj}.bump({self.rng.randint(0, 9)}))")
+            else:
+                self.emit(indent, f"print({obj}.get({self.expr(1)}))")
+        else:
+            if not self.lists or self.rng.random() < 0.3:
+                name = f"xs{len(self.lists)}"
+                self.emit(indent, f"{name} = []")
+                if indent == 0:
+                    self.lists.append(name)
+            else:
+                self.emit(indent, f"{self.rng.choice(self.lists)}.append({self.expr(1)})")
+
+    def block(self, indent, depth):
+        for _ in range(self.rng.randint(1, 3)):
+            self.statement(indent, depth)
+
+# -------------------------
+# Engines
+# -------------------------
+def run_cpython(source):
+    namespace = {}
+    exec(compile(source, "<fuzz>", "exec"), namespace)
+    return namespace
+
+def run_uglier_block(source):
+    run_program(source.split("\n"))
+    return uglier.variables
+
+def run_uglier_resumable(source):
+    reset_state()
+    uglier.return_value = None
+    uglier.in_return = False
+    run = Run(source.split("\n"))
+    if run.start() is not None:
+        raise Exception("program waited for input")
+    return uglier.variables
+
+ENGINES = {
+    "execute_block": run_uglier_block,
+    "Run": run_uglier_resumable,
+}
+
+def observe(engine, source):
+    """Run source; returns (output, final variables, error flag, seconds)"""
+    old_stdout = sys.stdout
+    sys.stdout = buffer = io.StringIO()
+    error = False
+    namespace = {}
+    start = time.perf_counter()
+    try:
+        namespace = engine(source)
+    except (Exception, uglier.LimitExceeded):
+        error = True
+    finally:
+        elapsed = time.perf_counter() - start
+        sys.stdout = old_stdout
+    final = {k: v for k, v in namespace.items()
+             if k in VARIABLES or k.startswith(COMPARED_PREFIXES)}
+    return buffer.getvalue(), final, error, elapsed
+
+def compare(source, engines):
+    """Run source everywhere; returns (mismatches, {engine: seconds})"""
+    expected = observe(run_cpython, source)
+    timings = {"cpython": expected[3]}
+    mismatches = []
+    for name in engines:
+        got = observe(ENGINES[name], source)
+        timings[name] = got[3]
+        for field, want, have in zip(("output", "variables", "error"), expected[:3], got[:3]):
+            if want != have:
+                mismatches.append((name, field, want, have))
+    return mismatches, timings
+
+WHILE_STEP = re.compile(r'\s*w\d+ \+= 1$')
+
+def shrink(source, engines):
+    """Drop lines while the program still mismatches and still compiles"""
+    lines = source.splitlines()
+    i = len(lines) - 1
+    while i >= 0:
+        if WHILE_STEP.match(lines[i]):
+            # without its counter step the loop never ends under CPython
+            i -= 1
+            continue
+        candidate = lines[:i] + lines[i + 1:]
+        text = "\n".join(candidate) + "\n"
+        try:
+            compile(text, "<fuzz>", "exec")
+        except SyntaxError:
+            i -= 1
+            continue
+        if compare(text, engines)[0]:
+            lines = candidate
+        i -= 1
+    return "\n".join(lines) + "\n"
+
+# -------------------------
+# Main
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Differential fuzzing of Uglier against CPython")
+    parser.add_argument("--count", type=int, default=1000, help="programs to generate")
+    parser.add_argument("--seed", type=int, default=0, help="first seed; program n uses seed + n")
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=sorted(ENGINES))
+    parser.add_argument("--save", metavar="DIR", help="write shrunk failing programs here")
+    parser.add_argument("--show", type=int, default=3, help="failures to print in full")
+    args = parser.parse_args()
+
+    failures = 0
+    ratios = {name: [] for name in args.engines}
+    totals = {name: 0.0 for name in ["cpython", *args.engines]}
+    for n in range(args.count):
+        seed = args.seed + n
+        source = ProgramGenerator(random.Random(seed)).generate()
+        mismatches, timings = compare(source, args.engines)
+        for name, seconds in timings.items():
+            totals[name] += seconds
+        for name in args.engines:
+            ratios[name].append(timings[name] / max(timings["cpython"], 1e-9))
+        if not mismatches:
+            continue
+
+        failures += 1
+        small = shrink(source, args.engines)
+        if args.save:
+            os.makedirs(args.save, exist_ok=True)
+            with open(os.path.join(args.save, f"seed_{seed}.py"), "w") as f:
+                f.write(small)
+        if failures <= args.show:
+            print(f"--- seed {seed}: mismatch")
+            print(small)
+            for name, field, want, have in compare(small, args.engines)[0]:
+                print(f"  [{name}] {field}: CPython {want!r} / Uglier {have!r}")
+
+    print(f"\n{args.count} programs, {failures} mismatching")
+    print(f"{'engine':>14} {'total s':>10} {'median x CPython':>18}")
+    print(f"{'cpython':>14} {totals['cpython']:>10.3f} {1:>18.1f}")
+    for name in args.engines:
+        print(f"{name:>14} {totals[name]:>10.3f} {statistics.median(ratios[name]):>18.1f}")
+    sys.exit(1 if failures else 0)
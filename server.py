@@ -1,65 +1,798 @@
 from flask import Flask, request, jsonify, send_from_directory
-from uglier import execute_block, variables, functions, classes
+import uglier
+from uglier import execute_block, variables, functions, classes, set_stdin, reset_state, Run
 import sys
 import io
+import json
+import logging
+import time
 import traceback
 import os
+import copy
+import types
+import hashlib
+import heapq
+import hmac
+import itertools
+import math
+import secrets
+import threading
+from collections import OrderedDict, deque
+
+import uglier_parallel
+import uglier_profile
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    # /ws is only served when flask-sock is installed
+    Sock = None
 
 app = Flask(__name__, static_folder='.')
 
-@app.route("/")
-def index():
-    return send_from_directory('.', 'index.html')
+# Reverse proxies in front of the app (Railway has one). Only their
+# X-Forwarded-For entries are believed, so request.remote_addr is the real
+# client address and can't be picked by the client.
+trusted_proxies = int(os.environ.get("UGLIER_TRUSTED_PROXIES", "1"))
+if trusted_proxies:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+sock = Sock(app) if Sock is not None else None
 
-@app.route("/run", methods=["POST"])
-def run_code():
-    code = request.json.get("code", "")
-    output = []
+# input() never reads the worker's real stdin; each run supplies its own
+set_stdin("")
+
+# Hard ceiling on the worker's address space (0 turns it off). A single
+# allocation the per-session estimate only sees once it exists (e.g.
+# [0] * 10**9) then raises MemoryError instead of getting the whole worker
+# OOM-killed. The default follows the session memory limit: twice the limit,
+# plus room for the threads' stacks and allocator arenas, which reserve
+# address space well beyond what they use.
+memory_limit_mb = uglier.memory.limit // uglier.MB
+address_space_mb = int(os.environ.get(
+    "UGLIER_RLIMIT_AS_MB", str(2 * memory_limit_mb + 1536 if memory_limit_mb else 4096)))
+if address_space_mb:
+    try:
+        import resource
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (address_space_mb * 1024 * 1024, hard))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"Could not set UGLIER_RLIMIT_AS_MB: {e}", file=sys.stderr)
+
+# Interactive run paused at input(), waiting for POST /input or a
+# WebSocket input message. There is one slot for both, so a new run from
+# either transport cancels the paused one before it can go stale.
+pending_run = None
+
+class RunCache:
+    """LRU cache of /run responses for deterministic programs.
+    
+    Only runs that start from an empty session are cached, so the program
+    text alone determines the result. Each entry keeps the output and a
+    copy of the session state the run left behind, which is restored on a
+    hit so later requests see the same variables and functions. Entries
+    are bounded both in number and in estimated bytes; a run whose state
+    alone is over the byte limit is not cached. Neither is a run that
+    defines classes: class attributes can be reassigned later
+    (``C.count += 1``), and a class object can't be copied per entry.
+    """
+    def __init__(self, max_entries, max_output, max_bytes):
+        self.max_entries = max_entries
+        self.max_output = max_output
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+    
+    def key(self, code):
+        """Cache key for a run, or None if this run can't be cached"""
+        if not self.max_entries or variables or functions or classes \
+                or not uglier.is_deterministic(code):
+            with self.lock:
+                self.bypassed += 1
+            return None
+        return hashlib.sha256(code.encode()).hexdigest()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[:2]
+    
+    def put(self, key, output_text):
+        if len(output_text) > self.max_output or classes:
+            return
+        size = len(output_text) + sum(uglier.estimate_size(v) for v in variables.values())
+        if size > self.max_bytes:
+            return
+        try:
+            state = copy_state()
+        except Exception:
+            # e.g. generators, which can't be copied
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[key] = (output_text, state, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][2]
+                self.evictions += 1
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+# Values a run can't mutate, so cached state shares them instead of copying
+SHARED_TYPES = (types.ModuleType, str, bytes, int, float, complex, bool, type(None), range)
+
+def copy_value(value):
+    # immutable values and modules are shared, everything else is copied
+    # so runs can't see each other's mutations
+    if isinstance(value, SHARED_TYPES):
+        return value
+    return copy.deepcopy(value)
+
+def copy_state():
+    # function definitions are never changed once defined, and runs with
+    # classes aren't cached, so only the variables need copying
+    return ({k: copy_value(v) for k, v in variables.items()}, dict(functions), dict(classes))
+
+def restore_state(state):
+    saved_vars, saved_funcs, saved_classes = state
+    variables.update((k, copy_value(v)) for k, v in saved_vars.items())
+    functions.update(saved_funcs)
+    classes.update(saved_classes)
+
+run_cache = RunCache(
+    max_entries=int(os.environ.get("UGLIER_RUN_CACHE_SIZE", "256")),
+    max_output=int(os.environ.get("UGLIER_RUN_CACHE_MAX_OUTPUT", str(64 * 1024))),
+    max_bytes=int(float(os.environ.get("UGLIER_RUN_CACHE_MAX_MB", "64")) * uglier.MB))
+
+# One JSON line per /run, on stderr (gunicorn's error log)
+access_log = logging.getLogger("uglier.access")
+if not access_log.handlers:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    access_log.addHandler(handler)
+    access_log.setLevel(logging.INFO)
+    access_log.propagate = False
+
+class RunTimer:
+    """Wall-clock time per phase of a request, reported in a Server-Timing
+    header and a JSON access-log line"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}
+    
+    def phase(self, name):
+        return TimedPhase(self, name)
+    
+    def finish(self, response, **fields):
+        """Attach the Server-Timing header to response and log the request"""
+        total = (time.perf_counter() - self.start) * 1000
+        timings = [f"{name};dur={ms:.2f}" for name, ms in self.phases.items()]
+        timings.append(f"total;dur={total:.2f}")
+        response.headers["Server-Timing"] = ", ".join(timings)
+        access_log.info(json.dumps({
+            "path": request.path,
+            "status": response.status_code,
+            **fields,
+            "response_bytes": response.content_length,
+            "phases_ms": {name: round(ms, 3) for name, ms in self.phases.items()},
+            "total_ms": round(total, 3),
+        }))
+        return response
+
+class TimedPhase:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+    
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        self.timer.phases[self.name] = self.timer.phases.get(self.name, 0.0) + elapsed
+
+class QuotaExceeded(Exception):
+    """Request refused by the scheduler; retry_after is in seconds"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ClientUsage:
+    __slots__ = ("tokens", "updated", "recent", "queued")
+    
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated = now
+        self.recent = deque()
+        self.queued = 0
+
+class FairScheduler:
+    """CPU-time quotas and a fair queue for the interpreter.
+    
+    Each client has a token bucket of CPU seconds: it holds up to ``burst``
+    and refills at ``rate`` per second. A request names its client by a
+    few keys (see ``client_id``) and must have CPU left under every one of
+    them. IP keys get ``ip_factor`` times the bucket, since a classroom
+    behind one NAT shares an address. A run is charged the CPU time it
+    actually used, including its parallel_map worker processes, to every
+    key. While it holds its turn, ``uglier.budget`` stops it once it has
+    run for the seconds its client has left, or for ``max_run`` seconds,
+    whichever comes first; the cap holds even with quotas off.
+    
+    The interpreter state is shared by the whole worker, so runs take
+    turns. Waiting runs are ordered by their client's CPU use over the last
+    ``window`` seconds, so light users go ahead of heavy ones; ties go to
+    whoever came first. Idle clients with full buckets are forgotten.
+    """
+    PRUNE_AT = 1024
+    
+    def __init__(self, burst, rate, window, max_queued, wait_timeout, ip_factor, max_run):
+        self.burst = burst
+        self.rate = rate
+        self.window = window
+        self.max_queued = max_queued
+        self.wait_timeout = wait_timeout
+        self.ip_factor = ip_factor
+        self.max_run = max_run
+        self.lock = threading.Condition()
+        self.clients = {}
+        self.prune_at = self.PRUNE_AT
+        self.waiting = []
+        self.busy = False
+        self.order = itertools.count()
+    
+    def scale(self, key):
+        return self.ip_factor if key.startswith("ip:") else 1
+    
+    def usage(self, key, now):
+        """The key's record, with its bucket refilled and old usage dropped"""
+        burst = self.burst * self.scale(key)
+        record = self.clients.get(key)
+        if record is None:
+            record = self.clients[key] = ClientUsage(burst, now)
+        record.tokens = min(burst, record.tokens + (now - record.updated) * self.rate * self.scale(key))
+        record.updated = now
+        while record.recent and record.recent[0][0] < now - self.window:
+            record.recent.popleft()
+        return record
+    
+    def prune(self, now):
+        """Forget keys that are idle and back to a full bucket"""
+        for key in list(self.clients):
+            record = self.usage(key, now)
+            if not record.queued and not record.recent and record.tokens >= self.burst * self.scale(key):
+                del self.clients[key]
+        self.prune_at = max(self.PRUNE_AT, 2 * len(self.clients))
+    
+    def acquire(self, client):
+        """Wait for the turn of the client (a tuple of keys); returns a
+        ticket for release"""
+        now = time.monotonic()
+        with self.lock:
+            if len(self.clients) >= self.prune_at:
+                self.prune(now)
+            records = [self.usage(key, now) for key in client]
+            if self.rate:
+                for key, record in zip(client, records):
+                    if record.tokens <= 0:
+                        retry = math.ceil(-record.tokens / (self.rate * self.scale(key))) or 1
+                        raise QuotaExceeded("CPU quota exceeded", retry)
+            record = records[0]
+            if record.queued >= self.max_queued:
+                raise QuotaExceeded("Too many requests waiting", 1)
+            
+            entry = (sum(cpu for _, cpu in record.recent), next(self.order), client)
+            heapq.heappush(self.waiting, entry)
+            record.queued += 1
+            deadline = now + self.wait_timeout
+            try:
+                while self.busy or self.waiting[0] is not entry:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise QuotaExceeded("Server busy", math.ceil(self.wait_timeout))
+                    self.lock.wait(remaining)
+            except BaseException:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.lock.notify_all()
+                raise
+            finally:
+                record.queued -= 1
+            heapq.heappop(self.waiting)
+            self.busy = True
+            limits = [self.max_run] if self.max_run else []
+            if self.rate:
+                # a sliver of tokens must not round to 0, which means no deadline
+                limits.append(max(round(min(r.tokens for r in records), 3), 0.001))
+            if limits:
+                uglier.budget = uglier.Budget(seconds=min(limits))
+        return time.thread_time(), uglier_parallel.child_cpu
     
-    # Capture stdout
+    def release(self, client, ticket):
+        """End the client's turn, charging the CPU time it used, in this
+        thread and in worker processes; returns it"""
+        thread_start, child_start = ticket
+        cpu = time.thread_time() - thread_start + uglier_parallel.child_cpu - child_start
+        now = time.monotonic()
+        with self.lock:
+            uglier.budget = None
+            self.busy = False
+            for key in client:
+                record = self.usage(key, now)
+                record.tokens -= cpu
+                record.recent.append((now, cpu))
+            self.lock.notify_all()
+        return cpu
+    
+    def status(self, client):
+        with self.lock:
+            now = time.monotonic()
+            records = [self.usage(key, now) for key in client]
+            return {
+                "cpu_seconds_available": round(min(r.tokens for r in records), 3),
+                "burst": self.burst,
+                "refill_per_second": self.rate,
+                "recent_cpu_seconds": round(sum(cpu for _, cpu in records[0].recent), 3),
+                "window_seconds": self.window,
+                "waiting": len(self.waiting),
+            }
+
+scheduler = FairScheduler(
+    burst=float(os.environ.get("UGLIER_QUOTA_BURST", "20")),
+    rate=float(os.environ.get("UGLIER_QUOTA_RATE", "0.25")),
+    window=float(os.environ.get("UGLIER_QUOTA_WINDOW", "60")),
+    max_queued=int(os.environ.get("UGLIER_MAX_QUEUED", "4")),
+    wait_timeout=float(os.environ.get("UGLIER_QUEUE_TIMEOUT", "30")),
+    ip_factor=float(os.environ.get("UGLIER_QUOTA_IP_FACTOR", "4")),
+    max_run=float(os.environ.get("UGLIER_MAX_RUN_SECONDS", "10")))
+
+CLIENT_COOKIE = "uglier_client"
+
+# Client cookies are signed so they can't be made up. Set the secret when
+# running several workers, or each one rejects the others' cookies.
+CLIENT_SECRET = os.environ.get("UGLIER_CLIENT_SECRET", "").encode() or secrets.token_bytes(32)
+
+def sign_client(token):
+    return hmac.new(CLIENT_SECRET, token.encode(), hashlib.sha256).hexdigest()[:32]
+
+def client_token():
+    """The token from a correctly signed client cookie, or None"""
+    token, _, signature = request.cookies.get(CLIENT_COOKIE, "").partition(".")
+    if token and hmac.compare_digest(signature.encode(), sign_client(token).encode()):
+        return token
+    return None
+
+def client_id():
+    """Quota keys for the caller: the browser's client cookie if it has a
+    valid one (a classroom behind one NAT shares an IP but not cookies),
+    and always its IP address, so new cookies don't buy more CPU"""
+    ip_key = f"ip:{request.remote_addr}"
+    token = client_token()
+    return (f"c:{token}", ip_key) if token else (ip_key,)
+
+def too_many_requests(error):
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+def counting_statements(step, *args):
+    """Call step while counting the statements it executes; returns
+    (result, statements). The turn's budget does the counting when there
+    is one."""
+    counter = uglier.budget
+    if counter is not None:
+        start = counter.steps
+        return step(*args), counter.steps - start
+    counter = uglier.budget = uglier.Budget()
+    try:
+        return step(*args), counter.steps
+    finally:
+        uglier.budget = None
+
+def state_snapshot():
+    """Current interpreter state as JSON-friendly values"""
+    return {
+        "variables": {k: str(v) for k, v in variables.items()},
+        "functions": list(functions.keys()),
+        "classes": list(classes.keys())
+    }
+
+def capture(step, *args):
+    """Call step with stdout captured; returns (result, output_text)"""
     old_stdout = sys.stdout
     sys.stdout = io.StringIO()
+    result = None
     
     try:
-        # Split code into lines and execute
-        lines = code.split('\n')
-        execute_block(lines)
-        
-        # Get captured output
+        result = step(*args)
         output_text = sys.stdout.getvalue()
         
-    except Exception as e:
+    except (Exception, uglier.LimitExceeded) as e:
         # Get detailed error information
         error_details = traceback.format_exc()
-        output_text = f"Error: {str(e)}\n\n{error_details}"
+        output_text = f"{sys.stdout.getvalue()}Error: {str(e) or type(e).__name__}\n\n{error_details}"
     
     finally:
         # Restore stdout
         sys.stdout = old_stdout
     
+    return result, output_text
+
+def run_lines(lines):
+    """Execute a program; returns True if it finished without an error"""
+    execute_block(lines)
+    return True
+
+def cancel_pending_run():
+    global pending_run
+    if pending_run is not None:
+        pending_run.cancel()
+        pending_run = None
+
+@app.route("/")
+def index():
+    return send_from_directory('.', 'index.html')
+
+@app.route("/run", methods=["POST"])
+def run_code():
+    """Execute code.
+    
+    Optional payload fields: "stdin" holds the lines input() reads (it
+    raises EOFError once they run out), and "interactive": true makes the
+    program pause at input() instead, to be resumed through POST /input.
+    """
+    timer = RunTimer()
+    with timer.phase("parse"):
+        payload = request.get_json()
+        code = payload.get("code", "")
+        # Split code into lines and execute
+        lines = code.split('\n')
+    
+    client = client_id()
+    try:
+        with timer.phase("queue"):
+            ticket = scheduler.acquire(client)
+    except QuotaExceeded as e:
+        return timer.finish(too_many_requests(e), client=client[0], code_bytes=len(code))
+    try:
+        output_text, result, statements = execute_run(payload, code, lines, timer)
+        with timer.phase("snapshot"):
+            snapshot = state_snapshot()
+            state_bytes = sum(len(k) + len(v) for k, v in snapshot["variables"].items())
+    finally:
+        cpu = scheduler.release(client, ticket)
+    
+    with timer.phase("serialize"):
+        response = jsonify({"output": output_text, **result, **snapshot})
+    return timer.finish(
+        response,
+        client=client[0],
+        cpu_ms=round(cpu * 1000, 3),
+        code_bytes=len(code),
+        interactive=bool(payload.get("interactive")),
+        cached=bool(result.get("cached")),
+        statements=statements,
+        output_bytes=len(output_text),
+        state_bytes=state_bytes,
+        variables=len(snapshot["variables"]),
+    )
+
+def execute_run(payload, code, lines, timer):
+    """The interpreter part of /run; returns (output, extra response
+    fields, statements executed)"""
+    global pending_run
+    cancel_pending_run()
+    set_stdin(payload.get("stdin", ""))
+    
+    result = {}
+    statements = 0
+    if payload.get("interactive"):
+        run = Run(lines)
+        with timer.phase("execute"):
+            (prompt, output_text), statements = counting_statements(capture, run.start)
+        if run.waiting:
+            pending_run = run
+        result = {"waiting_for_input": run.waiting, "prompt": prompt}
+    else:
+        with timer.phase("cache"):
+            cache_key = run_cache.key(code)
+            cached = run_cache.get(cache_key) if cache_key is not None else None
+            if cached is not None:
+                output_text, state = cached
+                restore_state(state)
+                result = {"cached": True}
+        if cached is None:
+            with timer.phase("execute"):
+                (completed, output_text), statements = counting_statements(capture, run_lines, lines)
+            if cache_key is not None and completed:
+                with timer.phase("cache"):
+                    run_cache.put(cache_key, output_text)
+    return output_text, result, statements
+
+@app.route("/input", methods=["POST"])
+def send_input():
+    """Resume an interactive run that is waiting at input()"""
+    global pending_run
+    client = client_id()
+    try:
+        ticket = scheduler.acquire(client)
+    except QuotaExceeded as e:
+        return too_many_requests(e)
+    try:
+        if pending_run is None:
+            return jsonify({"error": "No program is waiting for input"}), 409
+        run = pending_run
+        prompt, output_text = capture(run.resume, request.json.get("text", ""))
+        if not run.waiting:
+            pending_run = None
+        snapshot = state_snapshot()
+    finally:
+        scheduler.release(client, ticket)
+    
     return jsonify({
         "output": output_text,
-        "variables": {k: str(v) for k, v in variables.items()},
-        "functions": list(functions.keys()),
-        "classes": list(classes.keys())
+        "waiting_for_input": run.waiting,
+        "prompt": prompt,
+        **snapshot
     })
 
 @app.route("/reset", methods=["POST"])
 def reset():
     """Reset the interpreter state"""
-    variables.clear()
-    functions.clear()
-    classes.clear()
+    client = client_id()
+    try:
+        ticket = scheduler.acquire(client)
+    except QuotaExceeded as e:
+        return too_many_requests(e)
+    try:
+        cancel_pending_run()
+        reset_state()
+    finally:
+        scheduler.release(client, ticket)
     return jsonify({"status": "reset"})
 
 @app.route("/state", methods=["GET"])
 def get_state():
-    """Get current interpreter state"""
-    return jsonify({
-        "variables": {k: str(v) for k, v in variables.items()},
-        "functions": list(functions.keys()),
-        "classes": list(classes.keys())
-    })
+    """Get current interpreter state, with the session's estimated memory"""
+    client = client_id()
+    try:
+        ticket = scheduler.acquire(client)
+    except QuotaExceeded as e:
+        return too_many_requests(e)
+    # measuring walks the variables, so no run may change them meanwhile
+    try:
+        snapshot = state_snapshot()
+        memory = {"bytes": uglier.memory.measure(), "limit": uglier.memory.limit}
+    finally:
+        scheduler.release(client, ticket)
+    return jsonify({**snapshot, "memory": memory})
+
+@app.route("/quota", methods=["GET"])
+def quota_status():
+    """The calling client's CPU quota and recent usage"""
+    return jsonify(scheduler.status(client_id()))
+
+@app.after_request
+def assign_client_cookie(response):
+    """Give each browser its own quota instead of sharing its IP's"""
+    if client_token() is None:
+        token = secrets.token_hex(16)
+        response.set_cookie(CLIENT_COOKIE, f"{token}.{sign_client(token)}", max_age=30 * 24 * 3600,
+                            httponly=True, samesite="Lax")
+    return response
+
+@app.route("/cache", methods=["GET"])
+def cache_stats():
+    """Response cache size and hit rate"""
+    return jsonify(run_cache.stats())
+
+class SocketOutput(io.TextIOBase):
+    """stdout for a WebSocket run: output is sent as frames while the
+    program runs, batched so a tight print loop doesn't send one frame
+    per line"""
+    FLUSH_BYTES = 8192
+    FLUSH_SECONDS = 0.05
+    
+    def __init__(self, ws):
+        self.ws = ws
+        self.parts = []
+        self.size = 0
+        self.last_flush = time.perf_counter()
+    
+    def writable(self):
+        return True
+    
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.FLUSH_BYTES or \
+                ("\n" in text and time.perf_counter() - self.last_flush >= self.FLUSH_SECONDS):
+            self.flush()
+        return len(text)
+    
+    def flush(self):
+        if self.parts:
+            self.ws.send(json.dumps({"type": "output", "text": "".join(self.parts)}))
+            self.parts = []
+            self.size = 0
+        self.last_flush = time.perf_counter()
+
+class StateTracker:
+    """Remembers what a WebSocket client has been sent, so each reply
+    carries only the variables, functions and classes that changed"""
+    def __init__(self):
+        self.sent = {"variables": {}, "functions": set(), "classes": set()}
+    
+    def delta(self):
+        old_vars = self.sent["variables"]
+        new_vars = {k: str(v) for k, v in variables.items()}
+        delta = {
+            "changed": {k: v for k, v in new_vars.items() if old_vars.get(k) != v},
+            "removed": [k for k in old_vars if k not in new_vars],
+        }
+        for kind, names in (("functions", functions), ("classes", classes)):
+            old, new = self.sent[kind], set(names)
+            delta[f"{kind}_added"] = sorted(new - old)
+            delta[f"{kind}_removed"] = sorted(old - new)
+            self.sent[kind] = new
+        self.sent["variables"] = new_vars
+        return delta
+
+def stream(ws, step, *args):
+    """Call step with stdout sent to ws as output frames; returns
+    (result, error_text)"""
+    old_stdout = sys.stdout
+    sys.stdout = out = SocketOutput(ws)
+    try:
+        return step(*args), None
+    except (Exception, uglier.LimitExceeded) as e:
+        return None, str(e)
+    finally:
+        out.flush()
+        sys.stdout = old_stdout
+
+# Each open connection holds a worker thread, so idle ones are closed
+WS_IDLE_SECONDS = float(os.environ.get("UGLIER_WS_IDLE_SECONDS", "60"))
+
+def repl_session(ws):
+    """WebSocket REPL.
+    
+    Client messages are JSON: {"type": "run", "code": ...},
+    {"type": "input", "text": ...} or {"type": "reset"}. Output arrives as
+    {"type": "output"} frames while the code runs, then one {"type": "done"}
+    frame with the state delta since the previous reply and, if the program
+    paused at input(), "waiting_for_input" and "prompt". A paused run
+    lives in the shared ``pending_run`` slot like one from /run, so it is
+    cancelled by the next run from either transport, under the scheduler.
+    The connection is closed after ``WS_IDLE_SECONDS`` without a message.
+    """
+    global pending_run
+    tracker = StateTracker()
+    client = client_id()
+    run = None
+    while True:
+        message = ws.receive(timeout=WS_IDLE_SECONDS)
+        if message is None:
+            break
+        try:
+            message = json.loads(message)
+        except ValueError:
+            ws.send(json.dumps({"type": "error", "error": "messages must be JSON"}))
+            continue
+        kind = message.get("type", "run")
+        
+        try:
+            ticket = scheduler.acquire(client)
+        except QuotaExceeded as e:
+            ws.send(json.dumps({"type": "error", "error": str(e), "retry_after": e.retry_after}))
+            continue
+        try:
+            error = None
+            prompt = None
+            if kind == "run":
+                cancel_pending_run()
+                set_stdin(message.get("stdin", ""))
+                run = Run(message.get("code", "").split('\n'))
+                prompt, error = stream(ws, run.start)
+            elif kind == "input":
+                if run is None or run is not pending_run:
+                    ws.send(json.dumps({"type": "error", "error": "No program is waiting for input"}))
+                    continue
+                prompt, error = stream(ws, run.resume, message.get("text", ""))
+            elif kind == "reset":
+                cancel_pending_run()
+                reset_state()
+                run = None
+            else:
+                ws.send(json.dumps({"type": "error", "error": f"unknown message type: {kind}"}))
+                continue
+        
+            waiting = run is not None and run.waiting
+            if waiting:
+                pending_run = run
+            elif pending_run is run:
+                pending_run = None
+            ws.send(json.dumps({
+                "type": "done",
+                "error": error,
+                "waiting_for_input": waiting,
+                "prompt": prompt if waiting else None,
+                **tracker.delta()
+            }))
+        finally:
+            scheduler.release(client, ticket)
+
+if sock is not None:
+    sock.route("/ws")(repl_session)
+
+# /debug/profile is disabled unless a token is configured
+DEBUG_TOKEN = os.environ.get("UGLIER_DEBUG_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.environ.get("UGLIER_PROFILE_MAX_SECONDS", "60"))
+profile_lock = threading.Lock()
+
+def debug_authorized():
+    # header only: a query-string token would end up in proxy and access logs
+    supplied = request.headers.get("Authorization", "")
+    if not supplied.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(supplied[7:].encode(), DEBUG_TOKEN.encode())
+
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    """Sample every thread's stack for ?seconds=N (default 5) and return
+    collapsed stacks for flame graph tools. Needs the UGLIER_DEBUG_TOKEN
+    as a Bearer token; one profile runs at a time."""
+    if not DEBUG_TOKEN:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    if not debug_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    try:
+        seconds = float(request.args.get("seconds", "5"))
+        interval = float(request.args.get("interval", str(uglier_profile.DEFAULT_INTERVAL)))
+    except ValueError:
+        return jsonify({"error": "seconds and interval must be numbers"}), 400
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or not 0.001 <= interval <= 1:
+        return jsonify({"error": f"seconds must be in (0, {PROFILE_MAX_SECONDS:g}] and interval in [0.001, 1]"}), 400
+    
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"error": "A profile is already running"}), 409
+    try:
+        counts = uglier_profile.sample(seconds, interval)
+    finally:
+        profile_lock.release()
+    return uglier_profile.collapse(counts), 200, {"Content-Type": "text/plain; charset=utf-8"}
 
 @app.route("/health")
 def health():
@@ -80,4 +813,3 @@ if __name__ == "__main__":
         debug=False,  # Disable debug mode in production
         threaded=True  # Enable threading for better performance
     )
-
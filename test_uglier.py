@@ -4,9 +4,13 @@ Test suite for Uglier interpreter
 Run this to verify all features work correctly
 """
 
+import uglier
 from uglier import execute_block, variables, functions, classes
 import sys
 import io
+import os
+import tempfile
+import time
 
 def capture_output(code):
     """Execute code and capture output"""
@@ -17,7 +21,7 @@ def capture_output(code):
         execute_block(code.split('\n'))
         output = sys.stdout.getvalue()
         return output, None
-    except Exception as e:
+    except (Exception, uglier.LimitExceeded) as e:
         return None, str(e)
     finally:
         sys.stdout = old_stdout
@@ -26,6 +30,32 @@ def capture_output(code):
         functions.clear()
         classes.clear()
 
+def run_interactive(code, inputs):
+    """Run code as a Run that pauses at input(), answering each prompt
+    from inputs; returns (prompts, output)"""
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    uglier.set_stdin("")
+    try:
+        run = uglier.Run(code.split('\n'))
+        prompts = [run.start()]
+        for text in inputs:
+            prompts.append(run.resume(text))
+        return prompts, sys.stdout.getvalue()
+    finally:
+        sys.stdout = old_stdout
+        uglier.stdin_buffer = None
+        uglier.reset_state()
+
+def check(name, ok, details):
+    """Report a test that checks values rather than a program's output"""
+    print(f"\n{'='*60}")
+    print(f"Testing: {name}")
+    print(f"{'='*60}")
+    print(details)
+    print("✓ Checks passed" if ok else "✗ Checks failed")
+    return ok
+
 def test(name, code, expected_output=None, should_error=False):
     """Run a test"""
     print(f"\n{'='*60}")
@@ -251,6 +281,411 @@ print greet("Bob")""", "Hello, Alice\nHello, Bob"):
     else:
         failed += 1
     
+    # Test 21: Classes with methods and instance attributes
+    if test("Classes", """class Counter:
+    def __init__(self, start):
+        self.value = start
+    def bump(self, step):
+        self.value += step
+        return self.value
+
+let c = Counter(10)
+c.bump(5)
+print c.bump(1)
+print c.value""", "16\n16"):
+        passed += 1
+    else:
+        failed += 1
+    
+    # Test 22: Inheritance and class attributes
+    if test("Class Inheritance", """class Shape:
+    sides = 0
+    def describe(self):
+        return "sides: " + str(self.sides)
+
+class Square(Shape):
+    sides = 4
+    def __init__(self, size):
+        self.size = size
+    def area(self):
+        return self.size * self.size
+
+class MyError(Exception): pass
+
+let s = Square(3)
+print s.describe()
+print s.area()
+print str(MyError("boom"))""", "sides: 4\n9\nboom"):
+        passed += 1
+    else:
+        failed += 1
+    
+    if test("Class Attribute Defaults", """class Counter:
+    count = 0
+    def bump(self):
+        self.count += 1
+        return self.count
+let c = Counter()
+c.bump()
+print c.bump()
+print Counter.count""", "2\n0"):
+        passed += 1
+    else:
+        failed += 1
+    
+    # Test 23: Generator pipeline
+    if test("Generators", """def count(n):
+    i = 0
+    while i < n:
+        yield i
+        i += 1
+
+def doubled(src):
+    for x in src:
+        yield x * 2
+
+let i = 99
+for v in doubled(count(3)):
+    print v
+print sum(doubled(range(4)))
+print i""", "0\n2\n4\n12\n99"):
+        passed += 1
+    else:
+        failed += 1
+    
+    # Test 24: Comprehensions
+    if test("Comprehensions", """def square(x):
+    return x * x
+
+let nums = [1, 2, 3, 4]
+let evens = [square(n) for n in nums if n % 2 == 0]
+print evens
+print {n: n * 10 for n in nums if n > 3}
+print sum(n for n in nums)""", "[4, 16]\n{4: 40}\n10"):
+        passed += 1
+    else:
+        failed += 1
+    
+    if test("Comprehensions Calling User Code", """def depth(n):
+    if n == 0:
+        return 0
+    return 1 + sum([depth(n - 1) for k in range(1)])
+
+def square(x):
+    return x * x
+
+class Box:
+    def __init__(self, v):
+        self.v = v
+    def get(self):
+        return self.v
+
+let x = 7
+let boxes = [Box(i) for i in range(3)]
+print depth(3000)
+print [b.get() for b in boxes]
+print [[square(y) for y in row] for row in [[1, 2], [3]]]
+print {k: square(v) for k, v in {"a": 2}.items()}
+print sum(square(x) for x in range(3)), x""", "3000\n[0, 1, 2]\n[[1, 4], [9]]\n{'a': 4}\n5 7"):
+        passed += 1
+    else:
+        failed += 1
+    
+    # Test 25: Numeric arrays
+    if test("Numeric Arrays", """let a = arange(6)
+let b = a * 2 + 1
+print b
+let view = b[1:3]
+view[0] = 0
+print b.tolist()
+print a[a > 3]
+print b.sum(), mean(a)""", "array([1, 3, 5, 7, 9, 11])\n[1, 0, 5, 7, 9, 11]\narray([4, 5])\n33 2.5"):
+        passed += 1
+    else:
+        failed += 1
+    
+    if test("Array Builtins In Expressions", """let a = array([1, 2, 3])
+print (zeros(2) + 1).tolist()
+print mean(a) * 2
+print a[(a > 1) & (a < 3)], a[~(a > 1) | (a == 3)]""", "[1.0, 1.0]\n4.0\narray([2]) array([1, 3])"):
+        passed += 1
+    else:
+        failed += 1
+    
+    # Test 26: Deep recursion beyond Python's recursion limit
+    if test("Deep Recursion", """def depth(n):
+    if n == 0:
+        return 0
+    return 1 + depth(n - 1)
+
+def total(n, acc):
+    if n == 0:
+        return acc
+    return total(n - 1, acc + n)
+
+def fib(n):
+    if n <= 1:
+        return n
+    return fib(n-1) + fib(n-2)
+
+def inner():
+    return x * 2
+
+def outer(x):
+    return inner()
+
+let x = 1
+print depth(5000)
+print total(20000, 0)
+print fib(10)
+print outer(5), x""", "5000\n200010000\n55\n10 1"):
+        passed += 1
+    else:
+        failed += 1
+    
+    if test("Deep Method Recursion", """class Node:
+    def __init__(self, value):
+        self.value = value
+    def depth(self, n):
+        if n == 0:
+            return 0
+        return 1 + self.depth(n - 1)
+
+def once(x):
+    yield x
+
+let it = iter([1, 2, 3])
+def first():
+    return once(next(it))
+
+let node = Node(7)
+print node.depth(5000)
+print list(first())
+print next(it)""", "5000\n[1]\n2"):
+        passed += 1
+    else:
+        failed += 1
+    
+    # Test 27: Literal data tables
+    if test("Literal Data", """let x = 7
+let rows = [{"name": "a, b", "ok": True}, {"name": "c", "ok": None}]
+let mixed = [1, 2.5, "three", x, (4, 5)]
+print rows[0]["name"]
+print mixed""", "a, b\n[1, 2.5, 'three', 7, (4, 5)]"):
+        passed += 1
+    else:
+        failed += 1
+    
+    if test("String Building", """let s = ""
+for i in range(5):
+    s += str(i)
+let t = s
+s += "x"
+print s, t, len(s)
+s = "new"
+s += "!"
+print s
+s = ""
+s += "a"
+s += "b"
+let u = s
+s += "x"
+s = u
+print s""", "01234x 01234 6\nnew!\nab"):
+        passed += 1
+    else:
+        failed += 1
+    
+    if test("Parallel Map", """let base = 10
+def square(x):
+    return x * x + base
+print parallel_map(square, range(6), workers=2)
+print list(map(square, [1, 2]))""", "[10, 11, 14, 19, 26, 35]\n[11, 14]"):
+        passed += 1
+    else:
+        failed += 1
+    
+    if test("Expression Grouping", """def half(n):
+    return n // 2
+let xs = [1, 2]
+let a = (3 + 4) * 2
+print (a)
+print half((a + 2) * max(1, 2))
+if len(xs) < (a // 4):
+    print 'grouped'""", "14\n16\ngrouped"):
+        passed += 1
+    else:
+        failed += 1
+    
+    # User modules are imported from the library path
+    with tempfile.TemporaryDirectory() as lib_dir:
+        with open(os.path.join(lib_dir, "shapes.ug"), "w") as f:
+            f.write("let SIDES = 4\nlet NAMES = [\"square\"]\n\ndef _sq(x):\n    return x * x\n\n"
+                    "def area(w):\n    return _sq(w) * SIDES\n\ndef add(name):\n    NAMES.append(name)\n\n"
+                    "class Tile:\n    def __init__(self, w):\n        self.w = w\n"
+                    "    def edges(self):\n        return self.w * SIDES\n")
+        with open(os.path.join(lib_dir, "dice.ug"), "w") as f:
+            f.write("import random\n\ndef roll():\n    return random.randint(1, 6)\n")
+        with open(os.path.join(lib_dir, "game.ug"), "w") as f:
+            f.write("import dice\n")
+        uglier.library_path.insert(0, lib_dir)
+        try:
+            ok = test("User Modules", """import shapes
+from shapes import area
+let SIDES = 3
+print shapes.area(2)
+print area(3)
+print SIDES
+print shapes.Tile(2).edges()
+try:
+    shapes.add("circle")
+except:
+    print "read-only"
+print shapes.NAMES""", "16\n36\n3\n8\nread-only\n['square']") and os.path.exists(os.path.join(lib_dir, "__ugcache__", "shapes.ugc")) \
+                and uglier.is_deterministic("import shapes") \
+                and not uglier.is_deterministic("import game\nprint game.dice.roll()") \
+                and uglier.find_module("../" + os.path.basename(lib_dir) + "/shapes") is None
+        finally:
+            uglier.library_path.remove(lib_dir)
+            uglier.modules.pop("shapes", None)
+    if ok:
+        passed += 1
+    else:
+        failed += 1
+    
+    # parallel_map stops waiting on its workers at the run's time budget
+    saved_workers = uglier.uglier_parallel.max_workers
+    uglier.uglier_parallel.max_workers = 2
+    uglier.budget = uglier.Budget(seconds=1)
+    started = time.perf_counter()
+    try:
+        ok = test("Parallel Map Deadline", """def spin(x):
+    for i in range(10**9):
+        let y = i
+print parallel_map(spin, range(4), workers=2)""", should_error=True) and time.perf_counter() - started < 10
+    finally:
+        uglier.budget = None
+        uglier.uglier_parallel.max_workers = saved_workers
+    if ok:
+        passed += 1
+    else:
+        failed += 1
+    
+    # Step budget stops a runaway loop
+    uglier.budget = uglier.Budget(max_steps=1000)
+    try:
+        ok = test("Step Budget", """let i = 0
+while True:
+    i += 1""", should_error=True)
+    finally:
+        uglier.budget = None
+    if ok:
+        passed += 1
+    else:
+        failed += 1
+    
+    # Memory cap refuses oversized values
+    saved_limit = uglier.memory.limit
+    uglier.memory.limit = 4 * uglier.MB
+    try:
+        ok = test("Memory Limit", """let small = [1, 2, 3]
+let big = list(range(1000000))""", should_error=True) and test("Memory Limit Ignores Except", """let piece = "x" * 500000
+let s = ""
+for i in range(20):
+    try:
+        s += piece
+    except:
+        pass""", should_error=True) and test("Memory Limit Counts Class Attributes", """class Store:
+    items = []
+for i in range(100000):
+    Store.items.append(str(i) * 100)""", should_error=True)
+    finally:
+        uglier.memory.limit = saved_limit
+    if ok:
+        passed += 1
+    else:
+        failed += 1
+    
+    # input() reads a per-run buffer and raises EOFError once it runs out
+    uglier.set_stdin("Ada\n")
+    try:
+        ok = test("Input Buffer", """let name = input("Name? ")
+print "Hi " + name
+try:
+    let again = input()
+except:
+    print "eof"
+""", "Name? Ada\nHi Ada\neof")
+    finally:
+        uglier.stdin_buffer = None
+    if ok:
+        passed += 1
+    else:
+        failed += 1
+    
+    # A Run pauses at input() with an empty buffer and resumes with the reply
+    prompts, output = run_interactive("""let a = input("a? ")
+let b = input("b? ")
+print int(a) + int(b)""", ["2", "3"])
+    if check("Interactive Run", prompts == ["a? ", "b? ", None] and output == "a? 2\nb? 3\n5\n",
+             f"prompts: {prompts}\noutput: {output!r}"):
+        passed += 1
+    else:
+        failed += 1
+    
+    # Server: /run responses are cached for fresh sessions, and a client
+    # without CPU quota gets 429 with Retry-After
+    os.environ.setdefault("UGLIER_RLIMIT_AS_MB", "0")
+    import server
+    server.access_log.disabled = True
+    client = server.app.test_client()
+    program = "let n = 6\nprint n * 7"
+    client.post("/reset")
+    first = client.post("/run", json={"code": program}).get_json()
+    client.post("/reset")
+    second = client.post("/run", json={"code": program}).get_json()
+    bypassed = server.run_cache.stats()["bypassed"]
+    follow_up = client.post("/run", json={"code": "print n"}).get_json()
+    ok = first["output"] == "42\n" and not first.get("cached") \
+        and second["output"] == "42\n" and second.get("cached") and second["variables"] == {"n": "6"} \
+        and follow_up["output"] == "6\n" and server.run_cache.stats()["bypassed"] == bypassed + 1
+    # class attributes can change after the run, so classes aren't cached
+    class_program = "class C:\n    count = 0\nC.count += 1\nprint C.count"
+    for _ in range(2):
+        client.post("/reset")
+        client.post("/run", json={"code": class_program})
+        client.post("/run", json={"code": "C.count += 10"})
+    client.post("/reset")
+    with_class = client.post("/run", json={"code": class_program + "\nC.count += 10\nprint C.count"}).get_json()
+    ok = ok and with_class["output"] == "1\n11\n" and not with_class.get("cached")
+    saved_scheduler = server.scheduler
+    spin = "let i = 0\nwhile i >= 0:\n    i += 1"
+    server.scheduler = server.FairScheduler(burst=0, rate=0.5, window=60, max_queued=4,
+                                            wait_timeout=1, ip_factor=1, max_run=0)
+    try:
+        refused = client.post("/run", json={"code": program})
+        # a turn is capped with quotas off, and a sliver of quota still
+        # gets a deadline
+        server.scheduler = server.FairScheduler(burst=20, rate=0, window=60, max_queued=4,
+                                                wait_timeout=1, ip_factor=1, max_run=0.2)
+        capped = client.post("/run", json={"code": spin}).get_json()
+        server.scheduler = server.FairScheduler(burst=0.0004, rate=0.001, window=60, max_queued=4,
+                                                wait_timeout=1, ip_factor=1, max_run=0)
+        sliver = client.post("/run", json={"code": spin}).get_json()
+    finally:
+        server.scheduler = saved_scheduler
+        client.post("/reset")
+    ok = ok and refused.status_code == 429 and refused.headers.get("Retry-After") == "1" \
+        and refused.get_json()["retry_after"] == 1 \
+        and "Time budget exceeded (0.2s)" in capped["output"] and "Time budget exceeded (0.001s)" in sliver["output"]
+    if check("Server Cache And Quota", ok,
+             f"first: {first}\nsecond: {second}\nfollow-up: {follow_up}\nwith class: {with_class}\n"
+             f"refused: {refused.status_code} {refused.get_json()}\n"
+             f"capped: {capped['output']!r}\nsliver: {sliver['output']!r}"):
+        passed += 1
+    else:
+        failed += 1
+    
     # Summary
     print("\n" + "="*60)
     print("TEST SUMMARY")
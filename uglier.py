@@ -1,9 +1,30 @@
 # uglier.py - 80% Python-Compatible Interpreter
 # Accepts both standard Python syntax AND simplified Uglier syntax
 import sys
+import ast
+import builtins
+import collections
+import functools
+import hashlib
+import itertools
+import json
 import math
+import operator
 import os
+import pickle
 import re
+import threading
+import time
+import types
+
+import uglier_array
+import uglier_parallel
+
+try:
+    import resource
+except ImportError:
+    # no peak-RSS reading on Windows; memory sweeps just run on schedule
+    resource = None
 
 # -------------------------
 # Global environment
@@ -13,16 +34,338 @@ functions = {}
 classes = {}
 return_value = None
 in_return = False
+temp_ids = itertools.count()
+str_builders = {}
+stdin_buffer = None
+budget = None
+max_call_depth = int(os.environ.get("UGLIER_MAX_CALL_DEPTH", "100000"))
+
+def read_input(prompt=""):
+    """input() for Uglier programs.
+    
+    Reads from ``stdin_buffer`` when one is set (as the web server does) and
+    raises EOFError once it is used up, instead of blocking on the real
+    stdin. With no buffer it falls back to the terminal.
+    """
+    if stdin_buffer is None:
+        return input(prompt)
+    print(prompt, end="")
+    if not stdin_buffer:
+        raise EOFError("EOF when reading a line")
+    line = stdin_buffer.popleft()
+    print(line)
+    return line
+
+def set_stdin(text):
+    """Serve input() from the lines of text instead of the real stdin"""
+    global stdin_buffer
+    stdin_buffer = collections.deque(text.splitlines())
+
+class LimitExceeded(BaseException):
+    """A run hit a resource limit. Not an ``Exception``, so neither a user
+    ``except`` nor the interpreter's own error wrapping can swallow it."""
+
+class BudgetExceeded(LimitExceeded):
+    """A run used up its statement or time budget"""
+
+class Budget:
+    """Statement and wall-clock limits for a run.
+    
+    ``run_block`` calls ``tick`` once per statement. The clock is only
+    read every ``CLOCK_EVERY`` statements to keep the check cheap.
+    """
+    __slots__ = ("max_steps", "deadline", "seconds", "steps")
+    CLOCK_EVERY = 256
+    
+    def __init__(self, max_steps=None, seconds=None):
+        self.max_steps = max_steps
+        self.seconds = seconds
+        self.deadline = time.perf_counter() + seconds if seconds else None
+        self.steps = 0
+    
+    def tick(self):
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded(f"Step budget exceeded ({self.max_steps} statements)")
+        if self.deadline is not None and not self.steps % self.CLOCK_EVERY:
+            if time.perf_counter() > self.deadline:
+                raise BudgetExceeded(f"Time budget exceeded ({self.seconds}s)")
+
+class MemoryLimitExceeded(LimitExceeded):
+    """A session's variables grew past the memory limit"""
+
+MB = 1024 * 1024
+
+class MemoryMeter:
+    """Approximate memory accounting for the session's variables.
+    
+    Sizes are estimated by ``estimate_size``, which samples large
+    containers instead of walking them. A value is checked when it is
+    assigned, so an oversized result is refused before it is stored, and
+    every ``SWEEP_EVERY`` statements the whole session is re-measured to
+    catch in-place growth such as ``xs.append(...)`` in a loop. The sweep
+    comes early when the process's peak RSS has grown by a quarter of the
+    limit, which is cheap to read every ``PEAK_EVERY`` statements. Pieces
+    waiting in string builders count too, and are checked as they arrive.
+    """
+    __slots__ = ("limit", "sizes", "used", "ticks", "peak")
+    SWEEP_EVERY = 1024
+    PEAK_EVERY = 32
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.sizes = {}
+        self.used = 0
+        self.ticks = 0
+        self.peak = 0
+    
+    def total(self):
+        return self.used + sum(builder[2] for builder in str_builders.values())
+    
+    def check_assignment(self, name, value):
+        size = estimate_size(value)
+        total = self.total() - self.sizes.get(name, 0) + size
+        if total > self.limit:
+            raise MemoryLimitExceeded(
+                f"Memory limit exceeded: assigning '{name}' would bring the session to "
+                f"~{total / MB:.1f} MB (limit {self.limit / MB:g} MB)")
+        self.used += size - self.sizes.get(name, 0)
+        self.sizes[name] = size
+    
+    def check_append(self, name, size):
+        """Refuse a string piece for name's builder past the limit"""
+        total = self.total() + size
+        if total > self.limit:
+            raise MemoryLimitExceeded(
+                f"Memory limit exceeded: appending to '{name}' would bring the session to "
+                f"~{total / MB:.1f} MB (limit {self.limit / MB:g} MB)")
+    
+    def peak_grew(self):
+        if resource is None:
+            return False
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == "darwin" else 1024
+        if peak - self.peak < self.limit // 4:
+            return False
+        self.peak = peak
+        return True
+    
+    def tick(self):
+        self.ticks += 1
+        if self.ticks >= self.SWEEP_EVERY or (not self.ticks % self.PEAK_EVERY and self.peak_grew()):
+            self.ticks = 0
+            total = self.measure()
+            if total > self.limit:
+                raise MemoryLimitExceeded(
+                    f"Memory limit exceeded: session uses ~{total / MB:.1f} MB (limit {self.limit / MB:g} MB)")
+    
+    def measure(self):
+        """Re-estimate every variable; returns the session total in bytes,
+        including pending string pieces"""
+        self.sizes = {name: estimate_size(value) for name, value in variables.items()}
+        self.used = sum(self.sizes.values())
+        return self.total()
+    
+    def reset(self):
+        self.sizes.clear()
+        self.used = 0
+        self.ticks = 0
+
+SAMPLE_ITEMS = 32
+ATOMIC_TYPES = (str, bytes, bytearray, int, float, complex, bool, type(None), range)
+SEQUENCE_TYPES = (list, tuple, set, frozenset, collections.deque)
+
+def estimate_size(value, depth=3):
+    """Approximate bytes held by value.
+    
+    Containers are sized from their first ``SAMPLE_ITEMS`` items,
+    extrapolated to the full length. An item repeated within the sample is
+    only counted once, so ``[0] * n`` costs its pointer array rather than
+    n ints. User classes count their attribute values, since programs can
+    keep data there (``Store.items.append(...)``), but not their methods.
+    Modules, functions and other classes count only themselves.
+    """
+    size = sys.getsizeof(value)
+    if depth == 0 or isinstance(value, ATOMIC_TYPES):
+        return size
+    if isinstance(value, uglier_array.NumArray):
+        return size + value.data.nbytes
+    if isinstance(value, dict):
+        count = len(value)
+        sample = itertools.islice(itertools.chain.from_iterable(value.items()), 2 * SAMPLE_ITEMS)
+        count *= 2
+    elif isinstance(value, SEQUENCE_TYPES):
+        count = len(value)
+        sample = itertools.islice(value, SAMPLE_ITEMS)
+    elif isinstance(value, type):
+        if value.__module__ != __name__:
+            return size
+        sample = [attr for name, attr in vars(value).items()
+                  if not name.startswith("__") and not callable(attr)
+                  and not isinstance(attr, types.MemberDescriptorType)]
+        count = len(sample)
+    elif hasattr(type(value), "__slots__") and type(value).__module__ == __name__:
+        # instance of a user class
+        sample = [getattr(value, slot) for slot in type(value).__slots__ if hasattr(value, slot)]
+        count = len(sample)
+    else:
+        return size
+    
+    seen = set()
+    sampled = 0
+    sampled_size = 0
+    for item in sample:
+        sampled += 1
+        if id(item) not in seen:
+            seen.add(id(item))
+            sampled_size += estimate_size(item, depth - 1)
+    if sampled:
+        size += sampled_size * count // sampled
+    return size
+
+memory = MemoryMeter(int(float(os.environ.get("UGLIER_MEMORY_LIMIT_MB", "256")) * MB))
+
+def assign(name, value):
+    """Bind a variable, refusing values that would break the memory limit"""
+    if memory.limit:
+        memory.check_assignment(name, value)
+    if str_builders:
+        str_builders.pop(name, None)
+    variables[name] = value
+
+def reset_state():
+    """Forget all user variables, functions and classes"""
+    variables.clear()
+    functions.clear()
+    classes.clear()
+    str_builders.clear()
+    memory.reset()
+
+def parallel_map(func, iterable, workers=None):
+    """parallel_map(f, items, workers=N) - call a user function on every
+    item across worker processes and return the results in order.
+    
+    Workers run isolated interpreters that see the program's functions and
+    picklable variables as they were at the call; assignments they make do
+    not come back. ``workers`` is capped by ``UGLIER_MAX_WORKERS``, and
+    the workers stop at the run's time budget.
+    """
+    definition = getattr(func, "uglier_func", None)
+    func_name = getattr(func, "__qualname__", "")
+    if definition is None or functions.get(func_name) is not definition:
+        raise Exception("parallel_map needs a top-level user-defined function")
+    if definition.get("generator"):
+        raise Exception(f"parallel_map cannot run generator function '{func_name}'")
+    
+    items = list(iterable)
+    workers = min(uglier_parallel.worker_count(workers), len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    
+    flush_strs()
+    state = uglier_parallel.snapshot(functions, variables)
+    deadline = budget.deadline if budget is not None else None
+    results = []
+    try:
+        for chunk_results, output, _ in uglier_parallel.map_chunks(state, func_name, items, workers, deadline):
+            print(output, end="")
+            results.extend(chunk_results)
+    except uglier_parallel.DeadlineReached:
+        raise BudgetExceeded(f"Time budget exceeded ({budget.seconds}s)") from None
+    return results
+
+BUILTINS = {
+    "print": print,
+    "len": len,
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": bool,
+    "list": list,
+    "dict": dict,
+    "tuple": tuple,
+    "set": set,
+    "abs": abs,
+    "max": max,
+    "min": min,
+    "sum": sum,
+    "range": range,
+    "enumerate": enumerate,
+    "zip": zip,
+    "map": map,
+    "filter": filter,
+    "sorted": sorted,
+    "reversed": reversed,
+    "round": round,
+    "type": type,
+    "isinstance": isinstance,
+    "input": read_input,
+    "iter": iter,
+    "next": next,
+    "pow": pow,
+    "all": all,
+    "any": any,
+    "chr": chr,
+    "ord": ord,
+    "array": uglier_array.array,
+    "zeros": uglier_array.zeros,
+    "arange": uglier_array.arange,
+    "mean": uglier_array.mean,
+    "parallel_map": parallel_map,
+}
+
+# Builtin classes a user class may name as a base, e.g. class MyError(Exception)
+BASE_TYPES = {name: value for name, value in vars(builtins).items()
+              if isinstance(value, type) and issubclass(value, BaseException)}
+BASE_TYPES["object"] = object
+
+NOT_LITERAL = object()
+MISSING = object()
+BARE_NAME = re.compile(r'(?<![\d.])[A-Za-z_]')
+LITERAL_TYPES = {"[": list, "{": (dict, set), "(": tuple}
+SCALAR_NAMES = {"True": True, "False": False, "None": None}
+JSON_NAMES = {"True": "true", "False": "false", "None": "null"}
+KEYWORD_ARG = re.compile(r'\s*(\w+)\s*=(?!=)')
+NUMBER = re.compile(r'-?\d+(\.\d*)?([eE][-+]?\d+)?')
+
+COMPOUND_OPS = {
+    "+=": operator.add,
+    "-=": operator.sub,
+    "*=": operator.mul,
+    "/=": operator.truediv,
+    "//=": operator.floordiv,
+    "%=": operator.mod,
+    "**=": operator.pow,
+}
 
 # -------------------------
 # Helper functions
 # -------------------------
+def is_string_literal(expr):
+    """True when expr is exactly one quoted string (not e.g. "a" + "b")"""
+    if len(expr) < 2 or expr[0] not in "\"'":
+        return False
+    return expr.find(expr[0], 1) == len(expr) - 1
+
+def is_bracketed(expr):
+    """True when expr is one bracketed literal, e.g. [1, 2] but not (a) + (b)"""
+    if not expr or expr[0] not in "([{":
+        return False
+    for i, char, depth in scan_outside_strings(expr):
+        if depth == 0:
+            return i == len(expr) - 1
+    return False
+
 def parse_value(val):
     """Parse a value (string, number, bool, list, dict, etc.)"""
+    return run_frames(parse_steps(val))
+
+def parse_steps(val):
+    """Step generator behind parse_value"""
     val = val.strip()
     
     # String literals
-    if (val.startswith('"') and val.endswith('"')) or (val.startswith("'") and val.endswith("'")):
+    if is_string_literal(val):
         return val[1:-1]
     
     # Boolean
@@ -39,8 +382,7 @@ def parse_value(val):
     if val.startswith("[") and val.endswith("]"):
         if val == "[]":
             return []
-        items = split_by_comma(val[1:-1])
-        return [eval_expr(item) for item in items]
+        return (yield from eval_items(split_by_comma(val[1:-1])))
     
     # Dict literal
     if val.startswith("{") and val.endswith("}"):
@@ -51,13 +393,17 @@ def parse_value(val):
         for item in items:
             if ":" in item:
                 k, v = item.split(":", 1)
-                result[eval_expr(k.strip())] = eval_expr(v.strip())
+                key, value = yield from eval_items([k.strip(), v.strip()])
+                result[key] = value
         return result
     
-    # Tuple literal
+    # Tuple literal, or parentheses just grouping an expression
     if val.startswith("(") and val.endswith(")"):
-        items = split_by_comma(val[1:-1])
-        return tuple(eval_expr(item) for item in items)
+        inner = val[1:-1].strip()
+        items = split_by_comma(inner)
+        if len(items) == 1 and not inner.endswith(","):
+            return (yield from eval_steps(inner))
+        return tuple((yield from eval_items(items)))
     
     # Variable reference
     if val in variables:
@@ -72,43 +418,127 @@ def parse_value(val):
         pass
     
     # Try to evaluate as expression
-    return eval_expr(val)
+    return (yield from eval_steps(val))
+
+def eval_items(items):
+    """Step generator evaluating container items; plain scalars skip eval"""
+    result = []
+    for item in items:
+        value = scalar_literal(item)
+        if value is NOT_LITERAL:
+            value = yield from eval_steps(item)
+        result.append(value)
+    return result
+
+def scalar_literal(text):
+    """Value of a number, string, True/False/None literal, or NOT_LITERAL"""
+    match = NUMBER.fullmatch(text)
+    if match:
+        return float(text) if match.group(1) or match.group(2) else int(text)
+    if is_string_literal(text):
+        return text[1:-1]
+    return SCALAR_NAMES.get(text, NOT_LITERAL)
+
+def load_literal(text):
+    """Build a container that holds only literals, or return NOT_LITERAL.
+    
+    With only double-quoted strings, a quick look at the text outside the
+    strings rules out anything that names a variable or call; the rest is
+    respelled as JSON (True -> true ...) for the C json decoder. Other
+    Python literals (tuples, single quotes, non-string keys) go through
+    ast.literal_eval. Text with backslashes is left to the general path,
+    since Uglier strings don't process escapes.
+    """
+    if "\\" in text or "\0" in text:
+        return NOT_LITERAL
+    
+    value = NOT_LITERAL
+    if "'" not in text:
+        segments = text.split('"')
+        outside = "\0".join(segments[0::2])
+        probe = outside
+        for name in JSON_NAMES:
+            probe = probe.replace(name, "")
+        if BARE_NAME.search(probe):
+            return NOT_LITERAL
+        for name, json_name in JSON_NAMES.items():
+            outside = outside.replace(name, json_name)
+        segments[0::2] = outside.split("\0")
+        try:
+            value = json.loads('"'.join(segments))
+        except ValueError:
+            pass
+    
+    if value is NOT_LITERAL:
+        try:
+            value = ast.literal_eval(text)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            return NOT_LITERAL
+    
+    if not isinstance(value, LITERAL_TYPES[text[0]]):
+        return NOT_LITERAL
+    return value
 
 def split_by_comma(expr):
-    """Split expression by commas, respecting parentheses and brackets"""
+    """Split expression by commas, respecting brackets and string literals"""
     parts = []
-    current = ""
-    depth = 0
+    start = 0
     
-    for char in expr:
-        if char in "([{":
-            depth += 1
-            current += char
-        elif char in ")]}":
-            depth -= 1
-            current += char
-        elif char == "," and depth == 0:
-            parts.append(current.strip())
-            current = ""
-        else:
-            current += char
+    for i, char, depth in scan_outside_strings(expr, ","):
+        if char == "," and depth == 0:
+            parts.append(expr[start:i].strip())
+            start = i + 1
     
-    if current.strip():
-        parts.append(current.strip())
+    if expr[start:].strip():
+        parts.append(expr[start:].strip())
     
     return parts
 
 def eval_expr(expr):
     """Evaluate an expression - handles both Python and Uglier syntax"""
+    return run_frames(eval_steps(expr))
+
+def eval_args(args_str):
+    """Step generator evaluating a comma-separated argument list"""
+    args = []
+    if args_str.strip():
+        for arg in split_by_comma(args_str):
+            args.append((yield from eval_steps(arg)))
+    return args
+
+def eval_call_args(args_str):
+    """Like eval_args, but also collects `name=value` keyword arguments"""
+    args = []
+    kwargs = {}
+    if args_str.strip():
+        for arg in split_by_comma(args_str):
+            match = KEYWORD_ARG.match(arg)
+            if match:
+                kwargs[match.group(1)] = yield from eval_steps(arg[match.end():])
+            else:
+                args.append((yield from eval_steps(arg)))
+    return args, kwargs
+
+def eval_steps(expr):
+    """Step generator behind eval_expr.
+    
+    Calls to user functions are not made directly: they are yielded as
+    ``Call`` requests to the trampoline in ``drive``, so user recursion
+    grows an explicit frame stack instead of the Python stack.
+    """
     expr = expr.strip()
     
     if not expr:
         return None
     
     # Handle string literals
-    if (expr.startswith('"') and expr.endswith('"')) or (expr.startswith("'") and expr.endswith("'")):
+    if is_string_literal(expr):
         return expr[1:-1]
     
+    # Pending `s += ...` strings must be real before anything reads them
+    if str_builders:
+        flush_strs(expr)
+    
     # Handle boolean and None
     if expr == "True":
         return True
@@ -117,27 +547,73 @@ def eval_expr(expr):
     if expr == "None":
         return None
     
+    # Handle number literals
+    if NUMBER.fullmatch(expr):
+        return scalar_literal(expr)
+    
+    # Comprehensions and generator expressions run as one native loop,
+    # unless they call user code, which has to go through the trampoline
+    if has_comprehension(expr):
+        if not calls_user_code(expr):
+            return eval_native(expr)
+        return (yield from comprehension_expr_steps(expr))
+    
     # Handle list/dict/tuple literals
-    if expr.startswith("[") or expr.startswith("{") or (expr.startswith("(") and expr.endswith(")")):
-        return parse_value(expr)
+    if expr[0] in "[{(":
+        literal = load_literal(expr)
+        if literal is not NOT_LITERAL:
+            return literal
+    if is_bracketed(expr):
+        return (yield from parse_steps(expr))
     
     # Handle variable references
     if expr in variables:
         return variables[expr]
     
+    # A bare function name is a callable value, e.g. map(square, xs)
+    if expr in functions:
+        return make_method(functions[expr], expr)
+    
+    # Methods of user classes run on the frame stack like plain functions
+    if "." in expr and "(" in expr:
+        call = find_method_call(expr)
+        if call is not None:
+            method_call, func, qualname, receiver, args_str = call
+            args = receiver + (yield from eval_args(args_str))
+            if method_call == expr:
+                return (yield Call(func, qualname, args))
+            temp_name = f"__ug_tmp{next(temp_ids)}"
+            variables[temp_name] = yield Call(func, qualname, args)
+            try:
+                return (yield from eval_steps(expr.replace(method_call, temp_name, 1)))
+            finally:
+                variables.pop(temp_name, None)
+    
+    # Plain attribute reads skip building an eval namespace
+    if "." in expr:
+        chain = attribute_chain(expr)
+        if chain is not None and chain[0] in variables:
+            value = variables[chain[0]]
+            try:
+                for attr_name in chain[1]:
+                    value = getattr(value, attr_name)
+            except AttributeError as e:
+                raise Exception(f"Cannot evaluate expression '{expr}': {e}")
+            return value
+    
     # Handle attribute access (e.g., obj.method())
     if "." in expr and "(" in expr:
         obj_part = expr.split(".")[0].strip()
         if obj_part in variables:
             try:
                 return eval(expr, {"__builtins__": {}}, variables)
-            except:
+            except (NameError, SyntaxError):
                 pass
     
     # Handle indexing (e.g., list[0])
     if "[" in expr and "]" in expr and not expr.startswith("["):
         var_name = expr.split("[")[0].strip()
-        if var_name in variables:
+        if var_name in variables and is_subscript(expr):
             try:
                 return eval(expr, {"__builtins__": {}}, variables)
             except Exception as e:
@@ -151,125 +627,435 @@ def eval_expr(expr):
             func_name = match.group(1)
             args_str = match.group(2)
             
-            if func_name in functions:
-                args = []
-                if args_str.strip():
-                    args = [eval_expr(arg) for arg in split_by_comma(args_str)]
-                return call_function(func_name, args)
+            if func_name in functions and has_balanced_call(args_str):
+                args = yield from eval_args(args_str)
+                return (yield Call(functions[func_name], func_name, args))
         
-        # Complex expressions with function calls
+        # Complex expressions with function calls - results are bound to
+        # temporaries instead of being pasted back as text, so generators
+        # and large values flow through without being stringified
         temp_expr = expr
-        while True:
-            found = False
-            for func_name in functions:
-                pattern = rf'{func_name}\([^()]*\)'
-                matches = re.finditer(pattern, temp_expr)
-                for match in matches:
-                    func_call = match.group(0)
-                    args_str = func_call[len(func_name)+1:-1]
-                    args = []
-                    if args_str.strip():
-                        args = [eval_expr(arg) for arg in split_by_comma(args_str)]
-                    result = call_function(func_name, args)
-                    temp_expr = temp_expr.replace(func_call, str(result), 1)
-                    found = True
-                    break
-                if found:
+        temps = []
+        try:
+            while True:
+                found = False
+                for func_name in functions:
+                    call = find_call(temp_expr, func_name)
+                    if call:
+                        func_call, args_str = call
+                        args = yield from eval_args(args_str)
+                        result = yield Call(functions[func_name], func_name, args)
+                        temp_name = f"__ug_tmp{next(temp_ids)}"
+                        variables[temp_name] = result
+                        temps.append(temp_name)
+                        temp_expr = temp_expr.replace(func_call, temp_name, 1)
+                        found = True
+                        break
+                if not found:
                     break
-            if not found:
-                break
-        
-        if temp_expr != expr:
-            expr = temp_expr
+            
+            if temps:
+                return (yield from eval_steps(temp_expr))
+        finally:
+            for temp_name in temps:
+                variables.pop(temp_name, None)
     
     # Built-in functions
     if "(" in expr and expr.endswith(")"):
         func_name = expr.split("(")[0].strip()
         
-        builtins_map = {
-            "print": print,
-            "len": len,
-            "str": str,
-            "int": int,
-            "float": float,
-            "bool": bool,
-            "list": list,
-            "dict": dict,
-            "tuple": tuple,
-            "set": set,
-            "abs": abs,
-            "max": max,
-            "min": min,
-            "sum": sum,
-            "range": range,
-            "enumerate": enumerate,
-            "zip": zip,
-            "map": map,
-            "filter": filter,
-            "sorted": sorted,
-            "reversed": reversed,
-            "round": round,
-            "type": type,
-            "isinstance": isinstance,
-            "input": input,
-            "pow": pow,
-            "all": all,
-            "any": any,
-            "chr": chr,
-            "ord": ord,
-        }
+        builtin = BUILTINS.get(func_name)
+        if builtin is None and func_name and hasattr(math, func_name):
+            builtin = getattr(math, func_name)
         
         args_str = expr[expr.index("(")+1:-1]
-        args = []
-        if args_str.strip():
-            args = [eval_expr(arg) for arg in split_by_comma(args_str)]
-        
-        if func_name in builtins_map:
-            return builtins_map[func_name](*args)
-        
-        if hasattr(math, func_name):
-            return getattr(math, func_name)(*args)
+        if builtin is not None and has_balanced_call(args_str):
+            args, kwargs = yield from eval_call_args(args_str)
+            if builtin is read_input and stdin_buffer is not None and not stdin_buffer:
+                prompt = str(args[0]) if args else ""
+                print(prompt, end="")
+                return (yield Input(prompt))
+            return builtin(*args, **kwargs)
     
     # Handle arithmetic and comparison
     try:
-        safe_dict = {
-            "__builtins__": {},
-            "math": math,
-            "len": len,
-            "str": str,
-            "int": int,
-            "float": float,
-            "abs": abs,
-            "max": max,
-            "min": min,
-            "sum": sum,
-            "range": range,
-            "pow": pow,
-        }
+        safe_dict = {"__builtins__": {}, "math": math}
+        safe_dict.update(BUILTINS)
         safe_dict.update(variables)
         
         return eval(expr, safe_dict)
     except Exception as e:
         raise Exception(f"Cannot evaluate expression '{expr}': {e}")
 
+@functools.lru_cache(maxsize=None)
+def scan_pattern(extra):
+    """Regex matching string literals, brackets and the extra characters"""
+    return re.compile(r'"(?:[^"\\]|\\.)*"?|\'(?:[^\'\\]|\\.)*\'?|[()\[\]{}' + re.escape(extra) + ']')
+
+def scan_outside_strings(expr, extra=""):
+    """Yield (index, char, depth) for brackets, and any characters in extra,
+    that are outside string literals. Depth counts the bracket just opened."""
+    depth = 0
+    for match in scan_pattern(extra).finditer(expr):
+        char = match.group()
+        if char[0] in "\"'":
+            continue
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        yield match.start(), char, depth
+
+def has_balanced_call(args_str):
+    """True if args_str closes no bracket it did not open, i.e. in `f(...)`
+    the final `)` really belongs to `f` (unlike `f(a) + g(b)`)"""
+    return all(depth >= 0 for _, _, depth in scan_outside_strings(args_str))
+
+def is_subscript(expr):
+    """True if expr is only `name[...]`, `name[...][...]` and so on, so
+    `xs[0] + f(1)` goes through the usual call handling instead"""
+    match = re.match(r'[A-Za-z_]\w*(?=\[)', expr)
+    if not match:
+        return False
+    rest = expr[match.end():]
+    group_end = 0
+    for i, char, depth in scan_outside_strings(rest):
+        if depth == 1 and char in "([{" and (char != "[" or i != group_end):
+            return False
+        if depth == 0:
+            group_end = i + 1
+    return group_end == len(rest)
+
+def has_comprehension(expr):
+    """True if expr contains a bracketed `... for x in ...` clause"""
+    if "for" not in expr:
+        return False
+    for i, char, depth in scan_outside_strings(expr, "f"):
+        if depth > 0 and char == "f" and expr.startswith("for", i) \
+                and (i == 0 or not (expr[i-1].isalnum() or expr[i-1] == "_")) \
+                and i + 3 < len(expr) and expr[i+3].isspace():
+            return re.search(r'\sin\s', expr[i:]) is not None
+    return False
+
+@functools.lru_cache(maxsize=1024)
+def call_pattern(func_name):
+    """Regex matching the start of a call of func_name"""
+    return re.compile(rf'\b{func_name}\(')
+
+def find_call(expr, func_name):
+    """First call of func_name in expr, as (call text, argument text).
+    The closing paren is found by bracket depth, so arguments may contain
+    parentheses of their own."""
+    match = call_pattern(func_name).search(expr)
+    if not match:
+        return None
+    start = match.end()
+    for i, _, depth in scan_outside_strings(expr[start:]):
+        if depth < 0:
+            return expr[match.start():start + i + 1], expr[start:start + i]
+    return None
+
+METHOD_CALL = re.compile(r'(?<![\w.])([A-Za-z_]\w*)\.(\w+)\(')
+ATTRIBUTE_CHAIN = re.compile(r'([A-Za-z_]\w*)((?:\s*\.\s*[A-Za-z_]\w*)+)')
+
+@functools.lru_cache(maxsize=1024)
+def method_call_sites(expr):
+    """Every `name.method(...)` in expr outside string literals, as
+    (variable, method, call text, argument text). Parsed once per
+    expression; only the lookups in ``find_method_call`` run each time."""
+    strings = [m.span() for m in scan_pattern("").finditer(expr) if m.group()[0] in "\"'"]
+    sites = []
+    for match in METHOD_CALL.finditer(expr):
+        if any(start <= match.start() < end for start, end in strings):
+            continue
+        start = match.end()
+        for i, _, depth in scan_outside_strings(expr[start:]):
+            if depth < 0:
+                sites.append((match.group(1), match.group(2),
+                              expr[match.start():start + i + 1], expr[start:start + i]))
+                break
+    return tuple(sites)
+
+def find_method_call(expr):
+    """First call of a user-defined method through a variable in expr, as
+    (call text, definition, qualified name, receiver args, argument text).
+    The receiver list holds the instance for bound methods and is empty for
+    calls through the class, e.g. `Base.method(self, x)`."""
+    for var_name, method_name, call_text, args_str in method_call_sites(expr):
+        if var_name not in variables:
+            continue
+        attr = getattr(variables[var_name], method_name, None)
+        func = getattr(attr, "__func__", attr)
+        definition = getattr(func, "uglier_func", None)
+        if definition is not None:
+            receiver = [attr.__self__] if isinstance(attr, types.MethodType) else []
+            return call_text, definition, func.__qualname__, receiver, args_str
+    return None
+
+@functools.lru_cache(maxsize=1024)
+def attribute_chain(expr):
+    """(variable, attribute names) if expr only reads attributes, like
+    `p.x` or `self.pos.y`, otherwise None"""
+    match = ATTRIBUTE_CHAIN.fullmatch(expr)
+    if not match:
+        return None
+    return match.group(1), tuple(name.strip() for name in match.group(2).split(".")[1:])
+
+@functools.lru_cache(maxsize=1024)
+def compile_native(expr):
+    """Compile an expression once; repeated evaluations reuse the code object"""
+    return compile(expr, "<uglier>", "eval")
+
+def native_namespace():
+    """Globals for natively evaluated code: builtins and variables"""
+    namespace = {"__builtins__": {}, "math": math}
+    namespace.update(BUILTINS)
+    namespace.update(variables)
+    return namespace
+
+def eval_native(expr):
+    """Evaluate an expression directly with CPython (used for comprehensions
+    that call no user code, see ``calls_user_code``)"""
+    try:
+        code = compile_native(expr)
+    except SyntaxError as e:
+        raise Exception(f"Cannot evaluate expression '{expr}': {e}")
+    return eval(code, native_namespace())
+
+def blank_nested(text, strings=True, brackets=True):
+    """text with string literals and/or the inside of top-level brackets
+    replaced by spaces, so that names, keywords and operators can be found
+    with plain regexes. Positions are kept."""
+    chars = list(text)
+    depth = 0
+    opened = 0
+    for match in scan_pattern("").finditer(text):
+        token = match.group()
+        start, end = match.span()
+        if token[0] in "\"'":
+            if strings:
+                chars[start:end] = " " * (end - start)
+        elif token in "([{":
+            if not depth:
+                opened = end
+            depth += 1
+        else:
+            depth -= 1
+            if brackets and not depth:
+                chars[opened:start] = " " * (start - opened)
+    return "".join(chars)
+
+@functools.lru_cache(maxsize=1024)
+def expression_names(expr):
+    """(names, method names) used in expr outside string literals: bare
+    identifiers, and identifiers called as `.name(`"""
+    text = blank_nested(expr, brackets=False)
+    names = frozenset(re.findall(r'(?<![\w.])[A-Za-z_]\w*', text))
+    methods = frozenset(re.findall(r'\.\s*([A-Za-z_]\w*)\s*\(', text))
+    return names, methods
+
+def is_user_value(value):
+    """True for user classes and their instances, user modules, and
+    wrapped user functions: anything whose calls run interpreted code"""
+    owner = value if isinstance(value, (type, types.FunctionType)) else type(value)
+    return getattr(owner, "__module__", None) == __name__
+
+def calls_user_code(expr):
+    """True if evaluating expr may call interpreted code: it names a user
+    function or a variable holding user code, or calls a method that some
+    user class defines. Such expressions can't run natively, since the
+    calls would nest on the Python stack instead of the frame stack."""
+    names, methods = expression_names(expr)
+    for name in names:
+        if name in functions or (name in variables and is_user_value(variables[name])):
+            return True
+    if methods:
+        for info in classes.values():
+            if not methods.isdisjoint(info["methods"]):
+                return True
+    return False
+
+COMPREHENSION_KEYWORD = re.compile(r'(?<![\w.])(for|if|in)(?!\w)')
+
+def find_comprehension(expr):
+    """(open, close) indexes of the brackets around the outermost
+    comprehension in expr, or None"""
+    opened = []
+    best = None
+    for i, char, depth in scan_outside_strings(expr):
+        if char in "([{":
+            opened.append(i)
+            continue
+        if not opened:
+            return None
+        start = opened.pop()
+        inner = blank_nested(expr[start + 1:i])
+        if re.search(r'(?<![\w.])for\s', inner) and re.search(r'\sin\s', inner) \
+                and (best is None or depth < best[2] or (depth == best[2] and start < best[0])):
+            best = (start, i, depth)
+    return best[:2] if best else None
+
+def parse_comprehension(inner):
+    """Split the text inside a comprehension's brackets into (element,
+    clauses), each clause being ("for", targets, iterable) or ("if",
+    condition)"""
+    flat = blank_nested(inner)
+    keywords = [(m.group(1), m.start(), m.end()) for m in COMPREHENSION_KEYWORD.finditer(flat)]
+    # the element may hold `a if c else b`, so clauses begin at the first for
+    while keywords and keywords[0][0] != "for":
+        keywords.pop(0)
+    element = inner[:keywords[0][1]].strip()
+    clauses = []
+    i = 0
+    while i < len(keywords):
+        keyword, _, end = keywords[i]
+        i += 1
+        if keyword == "for":
+            while i < len(keywords) and keywords[i][0] != "in":
+                i += 1
+            if i == len(keywords):
+                raise Exception(f"Invalid comprehension: {inner}")
+            targets = inner[end:keywords[i][1]].strip().strip("()")
+            iter_start = keywords[i][2]
+            i += 1
+            while i < len(keywords) and keywords[i][0] == "in":
+                i += 1
+            iter_end = keywords[i][1] if i < len(keywords) else len(inner)
+            clauses.append(("for", [t.strip() for t in targets.split(",") if t.strip()],
+                            inner[iter_start:iter_end].strip()))
+        elif keyword == "if":
+            while i < len(keywords) and keywords[i][0] == "in":
+                i += 1
+            cond_end = keywords[i][1] if i < len(keywords) else len(inner)
+            clauses.append(("if", inner[end:cond_end].strip()))
+    return element, clauses
+
+def comprehension_expr_steps(expr):
+    """Step generator for an expression holding a comprehension that calls
+    user code. The outermost comprehension is evaluated element by element
+    through ``eval_steps``; if it is only part of expr, its value is bound
+    to a temporary and the rest of expr is evaluated as usual. Generator
+    expressions are evaluated eagerly and handed on as an iterator."""
+    span = find_comprehension(expr)
+    if span is None:
+        raise Exception(f"Cannot evaluate expression '{expr}': unbalanced brackets")
+    start, end = span
+    kind = expr[start]
+    call_arg = kind == "(" and re.search(r'[\w\])]\s*$', expr[:start]) is not None
+    inner = expr[start + 1:end]
+    element, clauses = parse_comprehension(inner)
+    
+    key = None
+    if kind == "{":
+        colon = blank_nested(element).find(":")
+        if colon != -1:
+            key, element = element[:colon].strip(), element[colon + 1:].strip()
+    results = []
+    yield from comprehension_steps(clauses, key, element, results)
+    
+    if kind == "[":
+        value = results
+    elif kind == "{":
+        value = dict(results) if key is not None else set(results)
+    else:
+        value = iter(results)
+    if start == 0 and end == len(expr) - 1:
+        return value
+    
+    temp_name = f"__ug_tmp{next(temp_ids)}"
+    variables[temp_name] = value
+    try:
+        if call_arg:
+            rest = expr[:start + 1] + temp_name + expr[end:]
+        else:
+            rest = expr[:start] + temp_name + expr[end + 1:]
+        return (yield from eval_steps(rest))
+    finally:
+        variables.pop(temp_name, None)
+
+def comprehension_steps(clauses, key, element, results):
+    """Run comprehension clauses, appending each element (or (key, value)
+    pair) to results. Loop variables are bound in ``variables`` like a for
+    loop's and restored afterwards; every element ticks the budget."""
+    if not clauses:
+        if budget is not None:
+            budget.tick()
+        if key is not None:
+            results.append(((yield from eval_steps(key)), (yield from eval_steps(element))))
+        else:
+            results.append((yield from eval_steps(element)))
+        return
+    
+    clause = clauses[0]
+    if clause[0] == "if":
+        if (yield from eval_steps(clause[1])):
+            yield from comprehension_steps(clauses[1:], key, element, results)
+        return
+    
+    _, targets, iterable_expr = clause
+    iterable = yield from eval_steps(iterable_expr)
+    if str_builders:
+        for name in targets:
+            flush_str(name)
+    saved = {name: variables.get(name, MISSING) for name in targets}
+    try:
+        for item in iterable:
+            if len(targets) == 1:
+                variables[targets[0]] = item
+            else:
+                values = list(item)
+                if len(values) != len(targets):
+                    raise Exception(f"Cannot unpack {len(values)} values into {len(targets)} names")
+                variables.update(zip(targets, values))
+            yield from comprehension_steps(clauses[1:], key, element, results)
+    finally:
+        for name, value in saved.items():
+            str_builders.pop(name, None)
+            if value is MISSING:
+                variables.pop(name, None)
+            else:
+                variables[name] = value
+
 def call_function(func_name, args):
     """Call a user-defined function"""
-    global return_value, in_return
-    
     if func_name not in functions:
         raise Exception(f"Function '{func_name}' not defined")
     
-    func = functions[func_name]
+    return invoke_function(functions[func_name], func_name, args)
+
+def invoke_function(func, func_name, args):
+    """Run a function definition (plain function or method) with bound args"""
+    check_arity(func, func_name, args)
+    if func.get("generator"):
+        return generator_frame(func, args)
+    return run_frames(call_steps(func, func_name, args))
+
+def check_arity(func, func_name, args):
+    if len(args) != len(func["args"]):
+        raise Exception(f"Function '{func_name}' expects {len(func['args'])} arguments, got {len(args)}")
+
+def call_steps(func, func_name, args, saved_vars=None):
+    """Frame for one call of a plain user function.
+    
+    ``saved_vars`` maps names to the values they had before the call
+    (``MISSING`` if unbound), to put back when the frame ends. A frame
+    started by a tail call takes over its caller's map, so the caller's
+    arguments stay visible to the callee, as dynamic scoping expects, and
+    are only restored once the callee returns.
+    """
+    global return_value, in_return
+    
     func_args = func["args"]
-    func_body = func["body"]
     
-    if len(args) != len(func_args):
-        raise Exception(f"Function '{func_name}' expects {len(func_args)} arguments, got {len(args)}")
+    for arg_name in func_args:
+        if arg_name in str_builders:
+            flush_str(arg_name)
     
-    saved_vars = {}
+    if saved_vars is None:
+        saved_vars = {}
     for arg_name in func_args:
-        if arg_name in variables:
-            saved_vars[arg_name] = variables[arg_name]
+        if arg_name not in saved_vars:
+            saved_vars[arg_name] = variables.get(arg_name, MISSING)
     
     for i, arg_name in enumerate(func_args):
         variables[arg_name] = args[i]
@@ -278,24 +1064,745 @@ def call_function(func_name, args):
     in_return = False
     
     try:
-        execute_block(func_body)
-    finally:
-        for arg_name in func_args:
-            if arg_name in saved_vars:
-                variables[arg_name] = saved_vars[arg_name]
-            elif arg_name in variables:
-                del variables[arg_name]
+        yield from run_block(func["body"], tail_ok=True)
+    except TailCall as tail:
+        # the callee's frame restores these bindings when it ends
+        tail.saved_vars = saved_vars
+        return None
+    except BaseException:
+        restore_bindings(saved_vars)
+        raise
+    restore_bindings(saved_vars)
     
     result = return_value
     return_value = None
     in_return = False
     return result
 
+def restore_bindings(saved_vars):
+    for name, value in saved_vars.items():
+        if value is MISSING:
+            variables.pop(name, None)
+        else:
+            variables[name] = value
+
+# -------------------------
+# Trampoline
+# -------------------------
+class Call:
+    """Request from a frame to call a user function"""
+    __slots__ = ("func", "name", "args", "tail")
+    
+    def __init__(self, func, name, args, tail=False):
+        self.func = func
+        self.name = name
+        self.args = args
+        self.tail = tail
+
+class TailCall(BaseException):
+    """Thrown by ``drive`` into a frame that made a tail call; the frame
+    hands over its saved bindings instead of restoring them"""
+    def __init__(self):
+        super().__init__()
+        self.saved_vars = None
+
+class Yield:
+    """Request from a generator body to hand a value to its consumer"""
+    __slots__ = ("value",)
+    
+    def __init__(self, value):
+        self.value = value
+
+class Input:
+    """Request for a line of input when the stdin buffer is empty"""
+    __slots__ = ("prompt",)
+    
+    def __init__(self, prompt):
+        self.prompt = prompt
+
+def drive(stack, value=None, error=None):
+    """Run the frames on an explicit stack until it empties or a frame yields.
+    
+    Frames are step generators. A frame that needs a user function call
+    yields a ``Call``; the callee's frame is pushed and its return value is
+    sent back into the caller once it finishes. Exceptions unwind one frame
+    at a time so ``finally`` blocks restore bindings and ``try`` blocks in
+    callers still see them. A tail call replaces the calling frame instead
+    of growing the stack; the new frame inherits the old one's bindings.
+    
+    Returns ``(True, value)`` when the stack is exhausted, or
+    ``(False, request)`` when a frame yields a ``Yield`` or ``Input``
+    request. The stack stays intact, so the caller can resume it later by
+    sending a value (or throwing an error) back in.
+    """
+    while stack:
+        try:
+            if error is not None:
+                pending, error = error, None
+                request = stack[-1].throw(pending)
+            else:
+                request = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+            continue
+        except BaseException as e:
+            stack.pop()
+            if not stack:
+                raise
+            error = e
+            continue
+        
+        value = None
+        if type(request) is not Call:
+            return False, request
+        
+        saved_vars = None
+        try:
+            check_arity(request.func, request.name, request.args)
+            if request.func.get("generator"):
+                value = generator_frame(request.func, request.args)
+                continue
+            if request.tail:
+                tail = TailCall()
+                try:
+                    stack.pop().throw(tail)
+                except StopIteration:
+                    pass
+                saved_vars = tail.saved_vars
+            elif len(stack) > max_call_depth:
+                raise RecursionError(f"Maximum call depth ({max_call_depth}) exceeded in '{request.name}'")
+        except Exception as e:
+            error = e
+            continue
+        stack.append(call_steps(request.func, request.name, request.args, saved_vars))
+    
+    return True, value
+
+def drive_to_yield(stack, value=None):
+    """Like drive, but answers Input requests with EOFError.
+    
+    Only a ``Run`` can pause for input; everywhere else an empty stdin
+    buffer behaves like end of file. Returns ``(done, value)``.
+    """
+    done, request = drive(stack, value)
+    while not done and type(request) is Input:
+        done, request = drive(stack, error=EOFError("EOF when reading a line"))
+    if done:
+        return True, request
+    return False, request.value
+
+def run_frames(frame):
+    """Drive a single frame to completion and return its result"""
+    done, value = drive_to_yield([frame])
+    if not done:
+        raise Exception("'yield' outside function")
+    return value
+
+class Run:
+    """A program run that can pause at input() and resume later.
+    
+    The run's frames stay suspended on its own stack while it waits, so no
+    thread is held. ``start`` and ``resume`` return the input prompt when
+    the program is waiting again, or None once it has finished.
+    """
+    def __init__(self, lines):
+        self.stack = [run_block(lines)]
+        self.waiting = False
+    
+    def start(self):
+        return self.advance(drive(self.stack))
+    
+    def resume(self, text):
+        if not self.waiting:
+            raise Exception("Program is not waiting for input")
+        print(text)
+        return self.advance(drive(self.stack, text))
+    
+    def advance(self, result):
+        flush_strs()
+        done, request = result
+        self.waiting = False
+        if done:
+            return None
+        if type(request) is not Input:
+            self.cancel()
+            raise Exception("'yield' outside function")
+        self.waiting = True
+        return request.prompt
+    
+    def cancel(self):
+        """Abandon the run, unwinding its frames so bindings are restored"""
+        global return_value, in_return
+        while self.stack:
+            self.stack.pop().close()
+        self.waiting = False
+        return_value = None
+        in_return = False
+
+def make_function(args, body):
+    """Build a function definition, noting whether it is a generator"""
+    func = {"args": args, "body": body}
+    if any(l.strip() == "yield" or l.strip().startswith("yield ") for l in body):
+        func["generator"] = True
+        func["locals"] = collect_locals(args, body)
+    return func
+
+def collect_locals(args, body):
+    """Names a function body binds: its args, assignment targets and loop variables"""
+    names = list(args)
+    for body_line in body:
+        stripped = body_line.strip()
+        if stripped.startswith("let "):
+            stripped = stripped[4:].strip()
+        match = re.match(r'for\s+(\w+)\s+in\s', stripped)
+        if not match:
+            match = re.match(r'^([\w\s,]+?)\s*(?:\*\*|//|[-+*/%])?=(?!=)', stripped)
+        if match:
+            for name in match.group(1).split(","):
+                name = name.strip()
+                if name and name not in names:
+                    names.append(name)
+    return names
+
+def generator_frame(func, args):
+    """Suspended frame for a generator function.
+    
+    The body runs on its own ``drive`` stack that is resumed one ``yield``
+    at a time. Between resumptions the frame's own bindings are kept in
+    ``frame_vars`` and the caller's values for those names are put back, so
+    several generators in a pipeline each see their own locals.
+    """
+    global return_value, in_return
+    
+    local_names = func["locals"]
+    frame_vars = dict(zip(func["args"], args))
+    stack = [run_block(func["body"])]
+    
+    while True:
+        if str_builders:
+            for name in local_names:
+                flush_str(name)
+        saved_vars = {}
+        for name in local_names:
+            if name in variables:
+                saved_vars[name] = variables[name]
+            if name in frame_vars:
+                variables[name] = frame_vars[name]
+            else:
+                variables.pop(name, None)
+        saved_return = (return_value, in_return)
+        
+        try:
+            done, value = drive_to_yield(stack)
+        finally:
+            for name in local_names:
+                flush_str(name)
+                if name in variables:
+                    frame_vars[name] = variables[name]
+                else:
+                    frame_vars.pop(name, None)
+                if name in saved_vars:
+                    variables[name] = saved_vars[name]
+                else:
+                    variables.pop(name, None)
+            return_value, in_return = saved_return
+        
+        if done:
+            return
+        yield value
+
+# -------------------------
+# Classes
+# -------------------------
+def make_method(func, qualname):
+    """Wrap a parsed method so Python attribute lookup can dispatch to it"""
+    def method(*args):
+        return invoke_function(func, qualname, list(args))
+    method.__name__ = qualname.rsplit(".", 1)[-1]
+    method.__qualname__ = qualname
+    method.uglier_func = func
+    return method
+
+def collect_slots(methods, reserved):
+    """Find instance attributes assigned through the receiver in any method"""
+    slots = []
+    for func in methods.values():
+        if not func["args"]:
+            continue
+        receiver = re.escape(func["args"][0])
+        pattern = re.compile(rf'^(?:let\s+)?{receiver}\.(\w+)\s*(?:\*\*|//|[-+*/%])?=(?!=)')
+        for body_line in func["body"]:
+            match = pattern.match(body_line.strip())
+            if match and match.group(1) not in reserved and match.group(1) not in slots:
+                slots.append(match.group(1))
+    return slots
+
+def build_class(class_name, bases, body):
+    """Build a real class from an Uglier class body.
+    
+    Instances get a fixed ``__slots__`` layout made of every attribute the
+    methods assign through their receiver, so there is no per-instance
+    ``__dict__`` unless an attribute also has a class-level default.
+    Methods live on the type, which lets CPython's type attribute cache
+    serve repeated method and attribute lookups.
+    """
+    methods = {}
+    class_attrs = {}
+    
+    i = 0
+    while i < len(body):
+        line = body[i]
+        stripped = line.strip()
+        
+        if stripped.startswith("def "):
+            match = re.match(r'def\s+(\w+)\s*\((.*?)\)\s*:', stripped)
+            if not match:
+                raise Exception(f"Invalid method definition: {stripped}")
+            
+            method_name = match.group(1)
+            args_str = match.group(2).strip()
+            args = [a.strip() for a in args_str.split(",")] if args_str else []
+            
+            method_body = []
+            i += 1
+            base_indent = None
+            while i < len(body) and body[i].startswith(" "):
+                body_indent = len(body[i]) - len(body[i].lstrip())
+                if base_indent is None:
+                    base_indent = body_indent
+                method_body.append(' ' * (body_indent - base_indent) + body[i].strip())
+                i += 1
+            
+            methods[method_name] = make_function(args, method_body)
+            continue
+        
+        if stripped == "pass" or stripped.startswith('"') or stripped.startswith("'"):
+            i += 1
+            continue
+        
+        if "=" in stripped:
+            attr_name, attr_expr = stripped.split("=", 1)
+            attr_name = attr_name.strip()
+            if attr_name.startswith("let "):
+                attr_name = attr_name[4:].strip()
+            class_attrs[attr_name] = eval_expr(attr_expr)
+            i += 1
+            continue
+        
+        raise Exception(f"Invalid statement in class body: {stripped}")
+    
+    inherited = set()
+    inherited_attrs = set()
+    has_dict = False
+    for base in bases:
+        for klass in base.__mro__:
+            own_slots = vars(klass).get("__slots__")
+            inherited.update(getattr(klass, "__slots__", ()))
+            inherited_attrs.update(vars(klass))
+            if klass is not object and (own_slots is None or "__dict__" in own_slots):
+                has_dict = True
+    
+    assigned = collect_slots(methods, inherited | set(methods))
+    # An attribute with a class-level default (`count = 0` in the body,
+    # `self.count += 1` in a method) can't also be a slot: the slot
+    # descriptor would replace the default. Such classes get a __dict__
+    # for those attributes instead.
+    shadowed = [name for name in assigned if name in class_attrs or name in inherited_attrs]
+    slots = [name for name in assigned if name not in shadowed]
+    if shadowed and not has_dict:
+        slots.append("__dict__")
+    
+    namespace = dict(class_attrs)
+    namespace["__slots__"] = tuple(slots)
+    for method_name, func in methods.items():
+        namespace[method_name] = make_method(func, f"{class_name}.{method_name}")
+    
+    metaclass = type
+    if loading_module is not None:
+        # a module's classes are shared by every session, like the module
+        namespace["__uglier_module__"] = loading_module
+        metaclass = SharedClass
+    cls = metaclass(class_name, tuple(bases), namespace)
+    return cls, methods
+
+# -------------------------
+# User modules
+# -------------------------
+MODULE_SUFFIX = ".ug"
+MODULE_CACHE_DIR = "__ugcache__"
+MODULE_CACHE_VERSION = 2
+
+# Code that uses these can give different results on every run
+NONDETERMINISTIC = re.compile(
+    r'^\s*(?:import|from)\s+(?:[\w.]+\s*,\s*)*(?:random|time|os|datetime|secrets|uuid)\b'
+    r'|\binput\b',
+    re.MULTILINE)
+IMPORTED_NAME = re.compile(r'^\s*(?:import|from)\s+(\w+)', re.MULTILINE)
+
+# Directories searched by `import name` for name.ug, before Python modules
+library_path = [p for p in os.environ.get(
+    "UGLIER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib")
+).split(os.pathsep) if p]
+
+# Loaded once per process and shared by every session that imports them
+modules = {}
+module_lock = threading.RLock()
+# Name of the module whose top-level code is running, if any
+loading_module = None
+
+class UglierModule(types.ModuleType):
+    """A loaded Uglier module. Its attributes can't be reassigned, since
+    every session in the process sees the same instance; container values
+    are frozen (see ``freeze``) and its classes are ``SharedClass``."""
+    def __setattr__(self, name, value):
+        raise AttributeError(f"module '{self.__name__}' is read-only")
+    
+    def __delattr__(self, name):
+        raise AttributeError(f"module '{self.__name__}' is read-only")
+
+class SharedClass(type):
+    """Metaclass of classes defined by user modules. Their attributes can't
+    be reassigned, since every session sees the same class; subclasses a
+    session defines are its own."""
+    def __setattr__(cls, name, value):
+        if "__uglier_module__" in vars(cls):
+            raise AttributeError(f"class '{cls.__name__}' from module "
+                                 f"'{cls.__uglier_module__}' is read-only")
+        super().__setattr__(name, value)
+    
+    def __delattr__(cls, name):
+        if "__uglier_module__" in vars(cls):
+            raise AttributeError(f"class '{cls.__name__}' from module "
+                                 f"'{cls.__uglier_module__}' is read-only")
+        super().__delattr__(name)
+
+def read_only(self, *args, **kwargs):
+    raise TypeError(f"{type(self).__name__} from a module is read-only; "
+                    f"copy it first, e.g. list(...) or dict(...)")
+
+class FrozenList(list):
+    """A list global of a user module: reads like a list, refuses changes"""
+    append = extend = insert = pop = remove = clear = sort = reverse = read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = read_only
+    
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+class FrozenDict(dict):
+    """A dict global of a user module: reads like a dict, refuses changes"""
+    pop = popitem = clear = update = setdefault = read_only
+    __setitem__ = __delitem__ = __ior__ = read_only
+    
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+# Module globals of these types are shared as they are
+SHARED_GLOBAL_TYPES = (str, bytes, int, float, complex, bool, type(None), range, frozenset,
+                       type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType)
+
+def freeze(value, where):
+    """Read-only version of a module global, for sharing between sessions.
+    Lists and tuples, dicts and sets are rebuilt frozen all the way down;
+    values that can't be frozen, such as instances, are refused."""
+    if isinstance(value, SHARED_GLOBAL_TYPES):
+        return value
+    if isinstance(value, list):
+        return FrozenList(freeze(item, where) for item in value)
+    if isinstance(value, tuple):
+        return tuple(freeze(item, where) for item in value)
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item, where)) for key, item in value.items())
+    if isinstance(value, set):
+        return frozenset(value)
+    if isinstance(value, uglier_array.NumArray):
+        return uglier_array.NumArray.view(value.data.toreadonly())
+    raise Exception(f"{where} can't be shared read-only between sessions: "
+                    f"{type(value).__name__} values can be changed")
+
+class ModuleScope:
+    """Binds a module's variables and functions while one of its functions
+    runs, so module code sees its own globals and sibling functions.
+    The caller's bindings for those names come back afterwards."""
+    def __init__(self, namespace, funcs):
+        self.namespace = namespace
+        self.funcs = funcs
+        self.saved = []
+    
+    def __enter__(self):
+        if str_builders:
+            for name in self.namespace:
+                flush_str(name)
+        self.saved.append((
+            {k: variables.get(k, MISSING) for k in self.namespace},
+            {k: functions.get(k, MISSING) for k in self.funcs},
+        ))
+        variables.update(self.namespace)
+        functions.update(self.funcs)
+    
+    def __exit__(self, *exc):
+        for ns, saved in zip((variables, functions), self.saved.pop()):
+            for k, v in saved.items():
+                if v is MISSING:
+                    ns.pop(k, None)
+                else:
+                    ns[k] = v
+    
+    def wrap(self, func, qualname):
+        """Callable module attribute for a function definition"""
+        def call(*args):
+            with self:
+                result = invoke_function(func, qualname, list(args))
+            if func.get("generator"):
+                return self.scoped(result)
+            return result
+        call.__name__ = qualname.rsplit(".", 1)[-1]
+        call.__qualname__ = qualname
+        return call
+    
+    def scoped(self, gen):
+        """Resume a module generator with the module's names bound"""
+        while True:
+            with self:
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+            yield item
+
+def find_module(name):
+    if not re.fullmatch(r'\w+', name):
+        return None
+    for directory in library_path:
+        path = os.path.join(directory, name + MODULE_SUFFIX)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def compile_module(source):
+    """Parse module source into its top-level function definitions and the
+    remaining top-level statements"""
+    lines = source.split("\n")
+    funcs = {}
+    rest = []
+    i = 0
+    while i < len(lines):
+        line = lines[i].rstrip()
+        match = re.match(r'def\s+(\w+)\s*\((.*?)\)\s*:', line)
+        if match:
+            args_str = match.group(2).strip()
+            args = [a.strip() for a in args_str.split(",")] if args_str else []
+            body, i = collect_body(lines, i + 1, 0)
+            funcs[match.group(1)] = make_function(args, body)
+            continue
+        rest.append(line)
+        i += 1
+    return {
+        "functions": funcs,
+        "lines": rest,
+        "nondeterministic": NONDETERMINISTIC.search(source) is not None,
+        "imports": IMPORTED_NAME.findall(source),
+    }
+
+def is_deterministic(source, seen=None):
+    """False if source, or any user module it imports directly or
+    indirectly, reads input or imports random, time, os and the like"""
+    if NONDETERMINISTIC.search(source):
+        return False
+    seen = set() if seen is None else seen
+    pending = IMPORTED_NAME.findall(source)
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        path = find_module(name)
+        if path is None:
+            continue
+        try:
+            code = load_compiled(path)
+        except Exception:
+            # the import itself will fail; just don't vouch for it
+            return False
+        if code["nondeterministic"]:
+            return False
+        pending.extend(code["imports"])
+    return True
+
+def load_compiled(path):
+    """Compiled form of the module at path.
+    
+    Like ``__pycache__``, the parse is stored next to the source in
+    ``__ugcache__``. The stored mtime and size are checked first; if they
+    differ the source is hashed, and a matching hash only refreshes the
+    stamp instead of re-parsing.
+    """
+    stat = os.stat(path)
+    cache_path = os.path.join(os.path.dirname(path), MODULE_CACHE_DIR, os.path.basename(path) + "c")
+    try:
+        with open(cache_path, "rb") as f:
+            cached = pickle.load(f)
+        if cached.get("version") != MODULE_CACHE_VERSION:
+            cached = None
+    except Exception:
+        cached = None
+    
+    if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+        return cached["code"]
+    
+    with open(path, "rb") as f:
+        source = f.read()
+    digest = hashlib.sha256(source).hexdigest()
+    if cached and cached["hash"] == digest:
+        code = cached["code"]
+    else:
+        code = compile_module(source.decode("utf-8"))
+    
+    entry = {
+        "version": MODULE_CACHE_VERSION,
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "hash": digest,
+        "code": code,
+    }
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # read-only library directories just don't get a cache
+        pass
+    return code
+
+def run_isolated(code, name):
+    """Run the compiled module called name on an empty interpreter state
+    and return the (variables, functions) it defines. The caller's state
+    is put back."""
+    global return_value, in_return, loading_module
+    flush_strs()
+    saved = [dict(ns) for ns in (variables, functions, classes)]
+    saved_return = return_value, in_return
+    saved_loading = loading_module
+    for ns in (variables, functions, classes):
+        ns.clear()
+    str_builders.clear()
+    loading_module = name
+    try:
+        functions.update(code["functions"])
+        execute_block(code["lines"])
+        return dict(variables), dict(functions)
+    finally:
+        for ns, old in zip((variables, functions, classes), saved):
+            ns.clear()
+            ns.update(old)
+        str_builders.clear()
+        return_value, in_return = saved_return
+        loading_module = saved_loading
+
+def share_class(cls, scope):
+    """Make a module's class run its methods in the module's scope, and
+    freeze its attribute values"""
+    for attr_name, value in list(vars(cls).items()):
+        func = getattr(value, "uglier_func", None)
+        if func is not None:
+            value = scope.wrap(func, value.__qualname__)
+        elif attr_name.startswith("__") or isinstance(value, types.MemberDescriptorType):
+            continue
+        else:
+            value = freeze(value, f"{cls.__qualname__}.{attr_name}")
+        type.__setattr__(cls, attr_name, value)
+
+def import_module(name):
+    """The user module called name, loading it on first use, or None if
+    no library directory has one"""
+    module = modules.get(name)
+    if module is not None:
+        return module
+    with module_lock:
+        if name in modules:
+            return modules[name]
+        path = find_module(name)
+        if path is None:
+            return None
+        namespace, funcs = run_isolated(load_compiled(path), name)
+        namespace = {k: freeze(v, f"module '{name}' global '{k}'") for k, v in namespace.items()}
+        scope = ModuleScope(namespace, funcs)
+        for value in namespace.values():
+            if isinstance(value, SharedClass) and vars(value).get("__uglier_module__") == name:
+                share_class(value, scope)
+        module = UglierModule(name)
+        module.__dict__.update(namespace)
+        for func_name, func in funcs.items():
+            module.__dict__[func_name] = scope.wrap(func, f"{name}.{func_name}")
+        module.__dict__["__file__"] = path
+        modules[name] = module
+        return module
+
+# -------------------------
+# String accumulation
+# -------------------------
+def append_str(var_name, current, piece):
+    """`s += piece` for strings without copying s every time.
+    
+    The first append stores a fresh concatenation in ``variables`` as the
+    builder's base; later appends only collect pieces. The real value is
+    materialized when something reads the name (see ``flush_strs``), which
+    also ends the builder. Every statement that binds the name drops its
+    builder, so a live builder always belongs to the current value.
+    """
+    builder = str_builders.get(var_name)
+    if builder is not None:
+        if memory.limit:
+            memory.check_append(var_name, sys.getsizeof(piece))
+        builder[1].append(piece)
+        builder[2] += sys.getsizeof(piece)
+        return
+    
+    joined = current + piece
+    assign(var_name, joined)
+    if joined is not current and joined is not piece:
+        str_builders[var_name] = [joined, [], 0]
+
+def flush_str(var_name):
+    """Materialize one pending builder into ``variables`` and drop it"""
+    builder = str_builders.pop(var_name, None)
+    if builder is not None and builder[1]:
+        value = builder[0] + "".join(builder[1])
+        if memory.limit:
+            # the pieces were already counted, so this only moves them
+            memory.used += sys.getsizeof(value) - memory.sizes.get(var_name, 0)
+            memory.sizes[var_name] = sys.getsizeof(value)
+        variables[var_name] = value
+
+def flush_strs(text=None):
+    """Materialize builders whose names appear in text (all when None)"""
+    for var_name in list(str_builders):
+        if text is None or (var_name in text and re.search(rf'\b{var_name}\b', text)):
+            flush_str(var_name)
+
 # -------------------------
 # Core execution
 # -------------------------
+def find_assignment(line):
+    """Index of a top-level plain `=` (not ==, <=, += ...), or None"""
+    for i, char, depth in scan_outside_strings(line, "="):
+        if char != "=" or depth != 0:
+            continue
+        prev_char = line[i-1] if i > 0 else ""
+        next_char = line[i+1] if i + 1 < len(line) else ""
+        if next_char == "=" or prev_char in "=!<>+-*/%":
+            return None
+        return i
+    return None
+
 def execute_line(line):
     """Execute a single line - accepts Python OR Uglier syntax"""
+    return run_frames(line_steps(line))
+
+def line_steps(line, tail_ok=False):
+    """Step generator behind execute_line"""
     global return_value, in_return
     
     line = line.strip()
@@ -304,8 +1811,15 @@ def execute_line(line):
         return
     
     # Return statement
-    if line.startswith("return "):
-        return_value = eval_expr(line[7:].strip())
+    if line == "return" or line.startswith("return "):
+        expr = line[6:].strip()
+        if tail_ok:
+            match = re.match(r'^(\w+)\((.*)\)$', expr)
+            if match and match.group(1) in functions and has_balanced_call(match.group(2)) \
+                    and not functions[match.group(1)].get("generator"):
+                args = yield from eval_args(match.group(2))
+                yield Call(functions[match.group(1)], match.group(1), args, tail=True)
+        return_value = yield from eval_steps(expr)
         in_return = True
         return
     
@@ -313,8 +1827,9 @@ def execute_line(line):
     if line.startswith("let "):
         line = line[4:].strip()
     
-    if "=" in line and not any(op in line for op in ["==", "!=", "<=", ">=", "+=", "-=", "*=", "/="]):
-        parts = line.split("=", 1)
+    assign_at = find_assignment(line)
+    if assign_at is not None:
+        parts = [line[:assign_at], line[assign_at+1:]]
         if len(parts) == 2:
             var_name = parts[0].strip()
             val_expr = parts[1].strip()
@@ -322,10 +1837,14 @@ def execute_line(line):
             if "[" in var_name and "]" in var_name:
                 base_var = var_name.split("[")[0].strip()
                 if base_var in variables:
+                    if str_builders:
+                        flush_strs(line)
                     exec(f"{line}", {"__builtins__": {}}, variables)
                     return
             elif "." in var_name:
-                exec(f"{line}", {"__builtins__": {}}, variables)
+                obj_expr, attr_name = var_name.rsplit(".", 1)
+                obj = yield from eval_steps(obj_expr)
+                setattr(obj, attr_name.strip(), (yield from eval_steps(val_expr)))
                 return
             else:
                 if "," in var_name:
@@ -334,35 +1853,32 @@ def execute_line(line):
                     if len(var_names) != len(values):
                         raise Exception("Number of variables doesn't match number of values")
                     for vn, ve in zip(var_names, values):
-                        variables[vn] = eval_expr(ve)
+                        assign(vn, (yield from eval_steps(ve)))
                 else:
-                    variables[var_name] = eval_expr(val_expr)
+                    assign(var_name, (yield from eval_steps(val_expr)))
                 return
     
     # Compound assignment
-    for op in ["+=", "-=", "*=", "/=", "//=", "%=", "**="]:
+    for op in ["**=", "//=", "+=", "-=", "*=", "/=", "%="]:
         if op in line:
             parts = line.split(op, 1)
             if len(parts) == 2:
                 var_name = parts[0].strip()
                 val_expr = parts[1].strip()
                 if var_name in variables:
+                    new_val = yield from eval_steps(val_expr)
                     current = variables[var_name]
-                    new_val = eval_expr(val_expr)
-                    if op == "+=":
-                        variables[var_name] = current + new_val
-                    elif op == "-=":
-                        variables[var_name] = current - new_val
-                    elif op == "*=":
-                        variables[var_name] = current * new_val
-                    elif op == "/=":
-                        variables[var_name] = current / new_val
-                    elif op == "//=":
-                        variables[var_name] = current // new_val
-                    elif op == "%=":
-                        variables[var_name] = current % new_val
-                    elif op == "**=":
-                        variables[var_name] = current ** new_val
+                    if op == "+=" and type(current) is str and type(new_val) is str:
+                        append_str(var_name, current, new_val)
+                    else:
+                        assign(var_name, COMPOUND_OPS[op](current, new_val))
+                    return
+                if "." in var_name:
+                    obj_expr, attr_name = var_name.rsplit(".", 1)
+                    obj = yield from eval_steps(obj_expr)
+                    attr_name = attr_name.strip()
+                    new_val = yield from eval_steps(val_expr)
+                    setattr(obj, attr_name, COMPOUND_OPS[op](getattr(obj, attr_name), new_val))
                     return
     
     # Print - accept both "print x" AND "print(x)"
@@ -376,11 +1892,10 @@ def execute_line(line):
             print()
         else:
             if "," in val_expr and not ('"' in val_expr or "'" in val_expr):
-                values = split_by_comma(val_expr)
-                results = [str(eval_expr(v)) for v in values]
-                print(" ".join(results))
+                values = yield from eval_args(val_expr)
+                print(" ".join(str(v) for v in values))
             else:
-                result = eval_expr(val_expr)
+                result = yield from eval_steps(val_expr)
                 print(result)
         return
     
@@ -392,21 +1907,24 @@ def execute_line(line):
                 if match:
                     module_name = match.group(1)
                     imports = match.group(2).strip()
-                    mod = __import__(module_name)
+                    mod = import_module(module_name) or __import__(module_name)
                     
                     if imports == "*":
                         for name in dir(mod):
                             if not name.startswith("_"):
-                                variables[name] = getattr(mod, name)
+                                assign(name, getattr(mod, name))
                     else:
                         for item in imports.split(","):
                             item = item.strip()
-                            variables[item] = getattr(mod, item)
+                            assign(item, getattr(mod, item))
             else:
                 module_name = line[7:].strip()
-                if module_name not in sys.modules:
-                    mod = __import__(module_name)
-                    variables[module_name] = mod
+                user_module = import_module(module_name)
+                if user_module is not None:
+                    assign(module_name, user_module)
+                else:
+                    mod = sys.modules.get(module_name) or __import__(module_name)
+                    assign(module_name, mod)
                     globals()[module_name] = mod
         except ImportError as e:
             raise Exception(f"Cannot import module: {e}")
@@ -421,7 +1939,7 @@ def execute_line(line):
         return
     
     # Expression evaluation
-    result = eval_expr(line)
+    result = yield from eval_steps(line)
     return result
 
 # -------------------------
@@ -429,6 +1947,38 @@ def execute_line(line):
 # -------------------------
 def execute_block(lines):
     """Execute a block with proper indentation handling"""
+    try:
+        run_frames(run_block(lines))
+    finally:
+        flush_strs()
+
+def collect_body(lines, i, indent):
+    """Gather the lines from i on that are indented deeper than indent,
+    re-indented relative to the first of them. Returns (body, next_i)."""
+    body = []
+    base_indent = None
+    while i < len(lines):
+        body_line = lines[i].rstrip()
+        if not body_line.strip():
+            i += 1
+            continue
+        body_indent = len(body_line) - len(body_line.lstrip())
+        if body_indent <= indent:
+            break
+        if base_indent is None:
+            base_indent = body_indent
+        body.append(' ' * (body_indent - base_indent) + body_line.strip())
+        i += 1
+    return body, i
+
+def run_block(lines, tail_ok=False):
+    """Step generator that executes a block.
+    
+    ``tail_ok`` is set for function bodies, where ``return f(...)`` may
+    replace the current frame. It is cleared inside ``try`` bodies so the
+    handler still sees exceptions raised by the callee, and inside ``for``
+    bodies, whose loop variable must be restored after the callee.
+    """
     global in_return
     
     i = 0
@@ -442,6 +1992,11 @@ def execute_block(lines):
             i += 1
             continue
         
+        if budget is not None:
+            budget.tick()
+        if memory.limit:
+            memory.tick()
+        
         indent = len(line) - len(line.lstrip())
         line = line.strip()
         
@@ -455,24 +2010,8 @@ def execute_block(lines):
             args_str = match.group(2).strip()
             args = [a.strip() for a in args_str.split(",")] if args_str else []
             
-            body = []
-            i += 1
-            base_indent = None
-            while i < len(lines):
-                body_line = lines[i].rstrip()
-                if not body_line.strip():
-                    i += 1
-                    continue
-                body_indent = len(body_line) - len(body_line.lstrip())
-                if body_indent <= indent:
-                    break
-                if base_indent is None:
-                    base_indent = body_indent
-                relative_indent = body_indent - base_indent
-                body.append(' ' * relative_indent + body_line.strip())
-                i += 1
-            
-            functions[func_name] = {"args": args, "body": body}
+            body, i = collect_body(lines, i + 1, indent)
+            functions[func_name] = make_function(args, body)
             continue
         
         # Class definition
@@ -482,22 +2021,18 @@ def execute_block(lines):
                 raise Exception(f"Invalid class definition: {line}")
             
             class_name = match.group(1)
+            bases = []
+            if match.group(2) and match.group(2)[1:-1].strip():
+                for base_expr in split_by_comma(match.group(2)[1:-1]):
+                    if base_expr in BASE_TYPES and base_expr not in variables:
+                        bases.append(BASE_TYPES[base_expr])
+                    else:
+                        bases.append((yield from eval_steps(base_expr)))
             
-            body = []
-            i += 1
-            while i < len(lines):
-                body_line = lines[i].rstrip()
-                if not body_line.strip():
-                    i += 1
-                    continue
-                body_indent = len(body_line) - len(body_line.lstrip())
-                if body_indent <= indent:
-                    break
-                body.append(body_line.strip())
-                i += 1
-            
-            classes[class_name] = {"body": body}
-            variables[class_name] = type(class_name, (), {})
+            body, i = collect_body(lines, i + 1, indent)
+            cls, methods = build_class(class_name, bases, body)
+            classes[class_name] = {"body": body, "methods": list(methods), "slots": list(cls.__slots__)}
+            assign(class_name, cls)
             continue
         
         # If/elif/else
@@ -506,10 +2041,10 @@ def execute_block(lines):
             
             if line.startswith("if "):
                 condition = line[3:].rstrip(":")
-                condition_result = bool(eval_expr(condition))
+                condition_result = bool((yield from eval_steps(condition)))
             elif line.startswith("elif "):
                 condition = line[5:].rstrip(":")
-                condition_result = bool(eval_expr(condition))
+                condition_result = bool((yield from eval_steps(condition)))
             elif line.startswith("else:") or line == "else":
                 condition_result = True
             
@@ -527,7 +2062,7 @@ def execute_block(lines):
                 i += 1
             
             if condition_result:
-                execute_block(body)
+                yield from run_block(body, tail_ok)
                 
                 while i < len(lines):
                     next_line = lines[i].strip()
@@ -566,17 +2101,17 @@ def execute_block(lines):
             
             max_iterations = 100000
             iteration = 0
-            while bool(eval_expr(condition)):
+            while bool((yield from eval_steps(condition))):
                 iteration += 1
                 if iteration > max_iterations:
                     raise Exception("While loop exceeded maximum iterations")
-                execute_block(body)
+                yield from run_block(body, tail_ok)
             
             continue
         
         # For loop
         if line.startswith("for "):
-            match = re.match(r'for\s+(\w+)\s+in\s+(.+?):', line)
+            match = re.match(r'for\s+(\w+)\s+in\s+(.+):\s*$', line)
             if not match:
                 raise Exception(f"Invalid for loop syntax: {line}")
             
@@ -596,13 +2131,19 @@ def execute_block(lines):
                 body.append(body_line)
                 i += 1
             
-            iterable = eval_expr(iterable_expr)
+            iterable = yield from eval_steps(iterable_expr)
+            if str_builders:
+                flush_str(var_name)
             saved_var = variables.get(var_name)
             
             for item in iterable:
+                if str_builders:
+                    str_builders.pop(var_name, None)
                 variables[var_name] = item
-                execute_block(body)
+                # no tail calls here: the callee would outlive the loop variable
+                yield from run_block(body)
             
+            str_builders.pop(var_name, None)
             if saved_var is not None:
                 variables[var_name] = saved_var
             elif var_name in variables:
@@ -640,21 +2181,28 @@ def execute_block(lines):
                     i += 1
             
             try:
-                execute_block(try_body)
+                yield from run_block(try_body)
             except Exception:
+                # LimitExceeded is a BaseException and passes through
                 if except_body:
-                    execute_block(except_body)
+                    yield from run_block(except_body, tail_ok)
             
             continue
         
+        # Yield statement (only reached inside a generator frame)
+        if line == "yield" or line.startswith("yield "):
+            yield Yield((yield from eval_steps(line[5:])))
+            i += 1
+            continue
+        
         # Regular statement
-        execute_line(line)
+        yield from line_steps(line, tail_ok)
         i += 1
 
 # -------------------------
-# Main REPL
+# Command line
 # -------------------------
-if __name__ == "__main__":
+def repl():
     print("Welcome to Uglier - 80% Python-Compatible Interpreter")
     print("Accepts both Python and Uglier syntax!")
     print("Type 'exit' or 'quit' to exit")
@@ -668,7 +2216,104 @@ if __name__ == "__main__":
                     break
                 if inp:
                     execute_block([inp])
-            except Exception as e:
+            except (Exception, LimitExceeded) as e:
                 print(f"Error: {e}")
     except (EOFError, KeyboardInterrupt):
         print("\nGoodbye!")
+
+def run_program(lines, run_budget=None):
+    """Run a whole program on a fresh interpreter, counting statements
+    against ``run_budget`` when one is given"""
+    global return_value, in_return, budget
+    reset_state()
+    return_value = None
+    in_return = False
+    budget = run_budget
+    try:
+        execute_block(lines)
+    finally:
+        budget = None
+
+def main(argv=None):
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        prog="uglier",
+        description="Run an Uglier program, or start the REPL when no program is given")
+    parser.add_argument("file", nargs="?", help="program file (.ug or .py), or - to read the program from stdin")
+    parser.add_argument("--time", action="store_true", help="report wall-clock time and statements executed")
+    parser.add_argument("--profile", action="store_true", help="profile the interpreter with cProfile")
+    parser.add_argument("--repeat", type=int, default=1, metavar="N", help="run the program N times (output is shown once)")
+    parser.add_argument("--budget-steps", type=int, metavar="N", help="stop after N statements")
+    parser.add_argument("--budget-time", type=float, metavar="SECONDS", help="stop after this many seconds")
+    args = parser.parse_args(argv)
+    
+    if args.file is None and sys.stdin.isatty():
+        repl()
+        return 0
+    
+    if args.file in (None, "-"):
+        source = sys.stdin.read()
+        # the program came from stdin, so input() sees end of file
+        set_stdin("")
+    else:
+        try:
+            with open(args.file) as f:
+                source = f.read()
+        except OSError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        # modules next to the program can be imported
+        library_path.insert(0, os.path.dirname(os.path.abspath(args.file)))
+    lines = source.split('\n')
+    
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    
+    timings = []
+    run_budget = None
+    real_stdout = sys.stdout
+    try:
+        for run in range(max(args.repeat, 1)):
+            if run:
+                # only the first run's output is shown
+                sys.stdout = open(os.devnull, "w")
+            run_budget = Budget(args.budget_steps, args.budget_time)
+            start = time.perf_counter()
+            if profiler:
+                profiler.enable()
+            try:
+                run_program(lines, run_budget)
+            finally:
+                if profiler:
+                    profiler.disable()
+                timings.append(time.perf_counter() - start)
+                if run:
+                    sys.stdout.close()
+                    sys.stdout = real_stdout
+    except (Exception, LimitExceeded) as e:
+        sys.stdout.flush()
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        sys.stdout.flush()
+        if args.time:
+            report_timings(timings, run_budget.steps if run_budget else 0)
+        if profiler:
+            import pstats
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    return 0
+
+def report_timings(timings, steps):
+    if len(timings) == 1:
+        print(f"time: {timings[0] * 1000:.2f} ms, {steps} statements", file=sys.stderr)
+        return
+    best = min(timings)
+    mean = sum(timings) / len(timings)
+    print(f"{len(timings)} runs: best {best * 1000:.2f} ms, mean {mean * 1000:.2f} ms, "
+          f"worst {max(timings) * 1000:.2f} ms, {steps} statements per run", file=sys.stderr)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,315 @@
+# uglier_array.py - Compact numeric arrays for Uglier programs
+# Backed by the stdlib array module so bulk arithmetic, comparisons and
+# reductions run in C-level loops instead of the interpreter loop.
+# Integer arrays hold 64-bit values: unlike Python ints they don't grow, and
+# a result that doesn't fit raises OverflowError (use dtype="float").
+import operator
+from array import array as buffer
+from itertools import compress, repeat
+
+INT = "q"
+FLOAT = "d"
+BOOL = "b"
+
+class NumArray:
+    """Fixed-length numeric array with elementwise operators.
+
+    Data lives in a stdlib ``array`` buffer and is accessed through a
+    memoryview, so slicing returns a view that shares memory with the
+    original instead of copying it. Boolean masks combine with ``&``,
+    ``|``, ``^`` and ``~``, which are bitwise on integer arrays.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, values=(), dtype=None):
+        if isinstance(values, NumArray):
+            values = values.data
+        if isinstance(values, memoryview):
+            typecode = dtype_code(dtype) or values.format
+            self.data = memoryview(new_buffer(typecode, values.tolist()))
+            return
+        if isinstance(values, range):
+            self.data = memoryview(new_buffer(dtype_code(dtype) or INT, values))
+            return
+        values = list(values)
+        typecode = dtype_code(dtype) or infer_code(values)
+        self.data = memoryview(new_buffer(typecode, values))
+
+    @classmethod
+    def view(cls, data):
+        """Wrap an existing memoryview without copying"""
+        arr = cls.__new__(cls)
+        arr.data = data
+        return arr
+
+    @property
+    def dtype(self):
+        return {INT: "int", FLOAT: "float", BOOL: "bool"}[self.data.format]
+
+    # -------------------------
+    # Sequence protocol
+    # -------------------------
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return NumArray.view(self.data[index])
+        if isinstance(index, NumArray):
+            if index.data.format != BOOL:
+                raise TypeError("array index must be a boolean mask")
+            self.check_length(index)
+            return from_iter(compress(self.data, index.data), self.data.format)
+        return self.data[index]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            target = self.data[index]
+            if isinstance(value, NumArray):
+                if len(value) != len(target):
+                    raise ValueError(f"cannot assign {len(value)} values to a slice of length {len(target)}")
+                for i, item in enumerate(value.data):
+                    target[i] = item
+            else:
+                value = coerce(value, target.format)
+                for i in range(len(target)):
+                    target[i] = value
+            return
+        self.data[index] = coerce(value, self.data.format)
+
+    def __repr__(self):
+        return f"array({self.tolist()})"
+
+    def __bool__(self):
+        if len(self.data) == 1:
+            return bool(self.data[0])
+        raise ValueError("truth value of an array is ambiguous; use .any() or .all()")
+
+    def check_length(self, other):
+        if len(other.data) != len(self.data):
+            raise ValueError(f"array lengths differ: {len(self.data)} and {len(other.data)}")
+
+    # -------------------------
+    # Elementwise operations
+    # -------------------------
+    def elementwise(self, other, op, typecode=None, reflected=False):
+        if isinstance(other, NumArray):
+            self.check_length(other)
+            right = other.data
+            other_code = other.data.format
+        elif isinstance(other, (int, float, bool)):
+            right = repeat(other, len(self.data))
+            other_code = FLOAT if isinstance(other, float) else INT
+        else:
+            return NotImplemented
+
+        if typecode is None:
+            typecode = FLOAT if FLOAT in (self.data.format, other_code) else INT
+        if reflected:
+            return from_iter(map(op, right, self.data), typecode)
+        return from_iter(map(op, self.data, right), typecode)
+
+    def __add__(self, other):
+        return self.elementwise(other, operator.add)
+
+    def __radd__(self, other):
+        return self.elementwise(other, operator.add, reflected=True)
+
+    def __sub__(self, other):
+        return self.elementwise(other, operator.sub)
+
+    def __rsub__(self, other):
+        return self.elementwise(other, operator.sub, reflected=True)
+
+    def __mul__(self, other):
+        return self.elementwise(other, operator.mul)
+
+    def __rmul__(self, other):
+        return self.elementwise(other, operator.mul, reflected=True)
+
+    def __truediv__(self, other):
+        return self.elementwise(other, operator.truediv, FLOAT)
+
+    def __rtruediv__(self, other):
+        return self.elementwise(other, operator.truediv, FLOAT, reflected=True)
+
+    def __floordiv__(self, other):
+        return self.elementwise(other, operator.floordiv)
+
+    def __rfloordiv__(self, other):
+        return self.elementwise(other, operator.floordiv, reflected=True)
+
+    def __mod__(self, other):
+        return self.elementwise(other, operator.mod)
+
+    def __rmod__(self, other):
+        return self.elementwise(other, operator.mod, reflected=True)
+
+    def __pow__(self, other):
+        try:
+            return self.elementwise(other, operator.pow)
+        except TypeError:
+            # negative integer exponents produce floats
+            return self.elementwise(other, operator.pow, FLOAT)
+
+    def __rpow__(self, other):
+        try:
+            return self.elementwise(other, operator.pow, reflected=True)
+        except TypeError:
+            return self.elementwise(other, operator.pow, FLOAT, reflected=True)
+
+    def __neg__(self):
+        return from_iter(map(operator.neg, self.data), self.data.format)
+
+    def __abs__(self):
+        return from_iter(map(abs, self.data), self.data.format)
+
+    def bitwise(self, other, op, reflected=False):
+        """&, | and ^: logical on boolean masks, bitwise on integers"""
+        if isinstance(other, NumArray):
+            other_code = other.data.format
+        elif isinstance(other, (int, bool)):
+            other_code = BOOL if isinstance(other, bool) else INT
+        else:
+            return NotImplemented
+        if FLOAT in (self.data.format, other_code):
+            raise TypeError("&, | and ^ need boolean or integer arrays")
+        typecode = BOOL if self.data.format == other_code == BOOL else INT
+        return self.elementwise(other, op, typecode, reflected)
+
+    def __and__(self, other):
+        return self.bitwise(other, operator.and_)
+
+    def __rand__(self, other):
+        return self.bitwise(other, operator.and_, reflected=True)
+
+    def __or__(self, other):
+        return self.bitwise(other, operator.or_)
+
+    def __ror__(self, other):
+        return self.bitwise(other, operator.or_, reflected=True)
+
+    def __xor__(self, other):
+        return self.bitwise(other, operator.xor)
+
+    def __rxor__(self, other):
+        return self.bitwise(other, operator.xor, reflected=True)
+
+    def __invert__(self):
+        if self.data.format == BOOL:
+            return from_iter(map(operator.not_, self.data), BOOL)
+        if self.data.format == FLOAT:
+            raise TypeError("~ needs a boolean or integer array")
+        return from_iter(map(operator.invert, self.data), INT)
+
+    def __eq__(self, other):
+        return self.elementwise(other, operator.eq, BOOL)
+
+    def __ne__(self, other):
+        return self.elementwise(other, operator.ne, BOOL)
+
+    def __lt__(self, other):
+        return self.elementwise(other, operator.lt, BOOL)
+
+    def __le__(self, other):
+        return self.elementwise(other, operator.le, BOOL)
+
+    def __gt__(self, other):
+        return self.elementwise(other, operator.gt, BOOL)
+
+    def __ge__(self, other):
+        return self.elementwise(other, operator.ge, BOOL)
+
+    __hash__ = None
+
+    # -------------------------
+    # Reductions
+    # -------------------------
+    def sum(self):
+        return sum(self.data)
+
+    def min(self):
+        return min(self.data)
+
+    def max(self):
+        return max(self.data)
+
+    def mean(self):
+        if not len(self.data):
+            raise ValueError("mean of an empty array")
+        return sum(self.data) / len(self.data)
+
+    def any(self):
+        return any(self.data)
+
+    def all(self):
+        return all(self.data)
+
+    def tolist(self):
+        if self.data.format == BOOL:
+            return [bool(v) for v in self.data]
+        return self.data.tolist()
+
+    def copy(self):
+        return NumArray(self.data)
+
+# -------------------------
+# Helpers
+# -------------------------
+def dtype_code(dtype):
+    """Map a user-facing dtype name to an array typecode"""
+    if dtype is None:
+        return None
+    codes = {"int": INT, "float": FLOAT, "bool": BOOL, int: INT, float: FLOAT, bool: BOOL}
+    if dtype not in codes:
+        raise ValueError(f"unsupported dtype: {dtype}")
+    return codes[dtype]
+
+def infer_code(values):
+    """Pick the narrowest typecode that holds every value"""
+    if all(isinstance(v, bool) for v in values) and values:
+        return BOOL
+    if all(isinstance(v, int) for v in values):
+        return INT
+    return FLOAT
+
+def coerce(value, typecode):
+    return float(value) if typecode == FLOAT else int(value)
+
+def new_buffer(typecode, values):
+    try:
+        return buffer(typecode, values)
+    except OverflowError:
+        raise OverflowError('integer array values must fit in 64 bits; use dtype="float" '
+                            'or a list for larger numbers') from None
+
+def from_iter(values, typecode):
+    return NumArray.view(memoryview(new_buffer(typecode, values)))
+
+# -------------------------
+# Builtins exposed to Uglier programs
+# -------------------------
+def array(values=(), dtype=None):
+    """array([1, 2, 3]) or array(range(n)) - build a numeric array"""
+    return NumArray(values, dtype)
+
+def zeros(n, dtype="float"):
+    """Array of n zeros"""
+    typecode = dtype_code(dtype)
+    return NumArray.view(memoryview(buffer(typecode, bytes(n * buffer(typecode).itemsize))))
+
+def arange(*args, dtype=None):
+    """Like range(), but returns an array"""
+    return NumArray(range(*args), dtype)
+
+def mean(values):
+    """Arithmetic mean of an array or any non-empty sequence"""
+    if isinstance(values, NumArray):
+        return values.mean()
+    values = list(values)
+    if not values:
+        raise ValueError("mean of an empty sequence")
+    return sum(values) / len(values)
@@ -0,0 +1,181 @@
+# uglier_parallel.py - Process pool behind the parallel_map builtin
+# Each worker process runs its own isolated interpreter. The parent ships a
+# pickled snapshot of the user's function definitions and plain variables
+# once per worker, and gets each chunk's results and printed output back in
+# order.
+import atexit
+import collections
+import hashlib
+import io
+import math
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+# Server policy: no program gets more worker processes than this, and every
+# program in the process shares one pool of this size
+max_workers = int(os.environ.get("UGLIER_MAX_WORKERS", str(os.cpu_count() or 1)))
+
+# Seconds a single chunk may run before its pool is torn down
+chunk_timeout = float(os.environ.get("UGLIER_CHUNK_TIMEOUT", "30"))
+
+# Chunks per worker; a few per worker balances uneven items without paying
+# IPC for every single argument
+CHUNKS_PER_WORKER = 4
+
+pool = None
+pool_lock = threading.Lock()
+
+# CPU seconds used by worker processes so far; the server charges the
+# difference over a run to its client
+child_cpu = 0.0
+
+def get_pool():
+    """The shared process pool, started on first use and reused"""
+    global pool
+    with pool_lock:
+        if pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            # the server is multi-threaded, so avoid plain fork
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            pool = ProcessPoolExecutor(max_workers, mp_context=context)
+        return pool
+
+def shutdown():
+    """Stop the pool's worker processes"""
+    global pool
+    with pool_lock:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = None
+
+def kill_pool(stuck):
+    """Terminate a pool whose workers stopped responding; the next call
+    starts a fresh one"""
+    global pool
+    with pool_lock:
+        if pool is stuck:
+            pool = None
+    for process in list((stuck._processes or {}).values()):
+        process.terminate()
+    stuck.shutdown(wait=False, cancel_futures=True)
+
+atexit.register(shutdown)
+
+def worker_count(requested):
+    """Clamp a requested worker count to server policy"""
+    if requested is None:
+        return max_workers
+    if not isinstance(requested, int) or requested < 1:
+        raise ValueError("workers must be a positive integer")
+    return min(requested, max_workers)
+
+def chunk_size(n, workers):
+    return max(1, math.ceil(n / (workers * CHUNKS_PER_WORKER)))
+
+def snapshot(functions, variables):
+    """Pickle the function definitions and every variable that can be
+    pickled; unpicklable values (generators, instances of user classes)
+    are left out of the worker's view. Returns (key, state)."""
+    shipped = {}
+    for name, value in variables.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        shipped[name] = value
+    state = pickle.dumps((functions, shipped))
+    return hashlib.sha256(state).hexdigest(), state
+
+# Worker side: the last state shipped to this process, as (key, pickle)
+cached_state = (None, None)
+
+class StateMissing:
+    """Returned by a worker that has not been sent the chunk's state"""
+
+class DeadlineReached(Exception):
+    """The caller's deadline passed while a chunk was still running"""
+
+def run_chunk(key, state, func_name, chunk):
+    """Worker entry point: call func_name once per item in chunk.
+    
+    ``state`` is only sent to workers that answered ``StateMissing``;
+    after that the worker keeps the pickle and reloads it for every chunk,
+    so chunks never see each other's assignments. Returns (results,
+    output, cpu seconds). Output is buffered so the parent can print it
+    in argument order.
+    """
+    global cached_state
+    import uglier
+    
+    if state is not None:
+        cached_state = (key, state)
+    elif cached_state[0] != key:
+        return StateMissing
+    
+    started = time.process_time()
+    functions, variables = pickle.loads(cached_state[1])
+    uglier.reset_state()
+    uglier.functions.update(functions)
+    uglier.variables.update(variables)
+    uglier.set_stdin("")
+    
+    func = uglier.functions[func_name]
+    old_stdout = sys.stdout
+    sys.stdout = io.StringIO()
+    try:
+        results = [uglier.invoke_function(func, func_name, [item]) for item in chunk]
+        return results, sys.stdout.getvalue(), time.process_time() - started
+    finally:
+        sys.stdout = old_stdout
+
+def map_chunks(snapshot_state, func_name, items, workers, deadline=None):
+    """Run func_name over items across the shared pool, yielding
+    (results, output, cpu seconds) per chunk in order.
+    
+    At most ``workers`` chunks of this call are in flight at a time, so
+    one program cannot take the whole pool. Each chunk first goes out
+    without the state; only workers that have not loaded it yet get sent
+    the pickle. A chunk that runs longer than ``chunk_timeout``, or past
+    ``deadline`` (a ``time.perf_counter`` value), kills the pool; the
+    latter raises ``DeadlineReached``.
+    """
+    global child_cpu
+    
+    def timeout():
+        if deadline is None:
+            return chunk_timeout
+        return min(chunk_timeout, max(deadline - time.perf_counter(), 0))
+    
+    key, state = snapshot_state
+    size = chunk_size(len(items), workers)
+    chunks = collections.deque(items[i:i + size] for i in range(0, len(items), size))
+    executor = get_pool()
+    in_flight = collections.deque()
+    try:
+        while chunks or in_flight:
+            while chunks and len(in_flight) < workers:
+                chunk = chunks.popleft()
+                in_flight.append((executor.submit(run_chunk, key, None, func_name, chunk), chunk))
+            future, chunk = in_flight.popleft()
+            waited = timeout()
+            result = future.result(timeout=waited)
+            if result is StateMissing:
+                waited = timeout()
+                result = executor.submit(run_chunk, key, state, func_name, chunk).result(timeout=waited)
+            child_cpu += result[2]
+            yield result
+    except TimeoutError:
+        # the stuck chunk burned at least this much
+        child_cpu += waited
+        kill_pool(executor)
+        if waited < chunk_timeout:
+            raise DeadlineReached("parallel_map ran past the run's deadline")
+        raise Exception(f"parallel_map chunk took longer than {chunk_timeout:g}s")
+    finally:
+        for future, _ in in_flight:
+            future.cancel()
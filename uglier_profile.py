@@ -0,0 +1,54 @@
+# uglier_profile.py - Thread-based sampling profiler for a live process
+# Reads every thread's current stack with sys._current_frames() at a fixed
+# interval and counts identical stacks. Nothing is installed in the sampled
+# threads (no settrace/setprofile, no signals), so it is safe to run on a
+# worker that is serving requests; the cost is one stack walk per thread
+# per sample, paid by the thread doing the sampling.
+import collections
+import os
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL = 0.005
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def stack_key(frame):
+    """Root-first tuple of frame labels for one thread's stack"""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+def sample(seconds, interval=DEFAULT_INTERVAL):
+    """Sample all other threads for the given seconds.
+
+    Returns a Counter mapping (thread name, *frames) to sample counts.
+    """
+    me = threading.get_ident()
+    counts = collections.Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            counts[(names.get(ident, f"thread-{ident}"),) + stack_key(frame)] += 1
+        # drop the frame references before sleeping
+        frame = None
+        time.sleep(interval)
+    return counts
+
+def collapse(counts):
+    """Render sample counts in the collapsed-stack format that flame graph
+    tools (flamegraph.pl, speedscope, inferno) read: one
+    `frame;frame;frame count` line per distinct stack"""
+    lines = []
+    for stack, count in counts.most_common():
+        lines.append(";".join(label.replace(";", ":") for label in stack) + f" {count}")
+    return "\n".join(lines) + "\n"